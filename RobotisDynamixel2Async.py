@@ -0,0 +1,160 @@
+import asyncio
+import perilib
+
+try:
+    import serial_asyncio
+except ImportError:
+    serial_asyncio = None
+
+from .RobotisDynamixel2Protocol import *
+from .RobotisDynamixel2ParserGenerator import *
+from .RobotisDynamixel2Device import *
+from .RobotisDynamixel2Transaction import *
+
+class RobotisDynamixel2AsyncDevice(RobotisDynamixel2Device, asyncio.Protocol):
+
+    def __init__(self, id=None, port=None, baudrate=None, protocol_class=RobotisDynamixel2Protocol):
+        super().__init__(id, port, baudrate)
+        self.transport = None
+        self.timeout = protocol_class.response_packet_timeout
+
+        # this object is its own stream: the parser/generator writes through
+        # it to the transport and is fed directly from data_received()
+        self.stream = self
+        self.parser_generator = RobotisDynamixel2ParserGenerator(protocol_class, self)
+        self.attach_stream(self)
+
+        # status replies carry no sequence number, so only one transaction
+        # may be on the bus at a time
+        self.transaction_lock = asyncio.Lock()
+        self.active = None
+
+    @classmethod
+    async def open_serial(cls, port, baudrate=57600, **kwargs):
+        # open a serial port as an asyncio transport driving a new device
+        if serial_asyncio is None:
+            raise perilib.PerilibProtocolException(
+                    "pyserial-asyncio is required to open '%s' as an asyncio transport" % port)
+        loop = asyncio.get_running_loop()
+        (transport, device) = await serial_asyncio.create_serial_connection(
+                loop, lambda: cls(id=port, port=port, baudrate=baudrate), port, baudrate=baudrate, **kwargs)
+        return device
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.parser_generator.parse(data)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if self.active is not None and not self.active.future.done():
+            self.active.future.set_exception(exc if exc is not None else
+                    perilib.PerilibProtocolException("Connection to '%s' lost" % self.port))
+
+    @property
+    def serial(self):
+        # underlying pyserial port (lets set_baudrate() reach it)
+        return getattr(self.transport, "serial", None)
+
+    def write(self, data):
+        self.transport.write(bytes(data))
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    def on_rx_packet(self, packet):
+        super().on_rx_packet(packet)
+
+        # hand replies to the transaction currently waiting on the bus
+        transaction = self.active
+        if transaction is not None and transaction.accepts(packet):
+            transaction.responses[packet.id] = packet
+            if transaction.is_complete():
+                transaction.complete()
+
+    async def transact(self, _packet_name, _timeout=None, **kwargs):
+        # send one instruction and await its reply/replies, same result shapes
+        # as the transaction queue (packet, None, or dict per servo ID)
+        (_packet_name, response_name, expected_ids) = RobotisDynamixel2Transaction.resolve(_packet_name, kwargs)
+        loop = asyncio.get_running_loop()
+        transaction = RobotisDynamixel2Transaction(_packet_name, kwargs, response_name, expected_ids,
+                future=loop.create_future())
+        async with self.transaction_lock:
+            transaction.packet = self.parser_generator.send_packet(_packet_name, **kwargs)
+            if response_name is None:
+                transaction.complete()
+                return await transaction.future
+
+            # timer handle completes with whatever arrived, no polling
+            self.active = transaction
+            timer = loop.call_later(_timeout if _timeout is not None else self.timeout, transaction.complete)
+            try:
+                return await transaction.future
+            finally:
+                timer.cancel()
+                self.active = None
+
+    async def ping_async(self, id):
+        return await self.transact("inst_ping", id=id)
+
+    async def scan_async(self, timeout=None):
+        # broadcast ping, replies create servo entries via on_rx_packet
+        await self.transact("inst_ping", _timeout=timeout, id=0xFE)
+
+        # mark as scanned and return servo count
+        self.is_scanned = True
+        return len(self.servos)
+
+    async def sync_read_async(self, field_names, servo_ids=None, timeout=None, fast=None):
+        (servo_ids, address, length, spans) = self.build_sync_read(field_names, servo_ids)
+        if len(servo_ids) == 0:
+            return {}
+
+        # use fast_sync_read if every servo supports it, else fall back to classic
+        if fast is None:
+            fast = self.fast_read_supported(servo_ids)
+        if fast:
+            packet = await self.transact("inst_fast_sync_read", _timeout=timeout,
+                    id=0xFE, address=address, length=length, id_list=bytes(servo_ids))
+            responses = self.decode_fast_status_packet(packet, spans)
+            if self.fast_read_succeeded(packet, responses):
+                return responses
+
+        responses = await self.transact("inst_sync_read", _timeout=timeout,
+                id=0xFE, address=address, length=length, id_list=bytes(servo_ids))
+        return self.decode_status_packets(responses, spans)
+
+    async def sync_write_async(self, field_name, values):
+        if len(values) == 0:
+            return None
+        packet = await self.transact("inst_sync_write", id=0xFE, **self.build_sync_write(field_name, values))
+        self.store_values(field_name, values)
+        return packet
+
+    async def bulk_read_async(self, specs, timeout=None, fast=None):
+        (spans, id_address_length_list) = self.build_bulk_read(specs)
+        if len(spans) == 0:
+            return {}
+
+        # use fast_bulk_read if every servo supports it, else fall back to classic
+        if fast is None:
+            fast = self.fast_read_supported(spans)
+        if fast:
+            packet = await self.transact("inst_fast_bulk_read", _timeout=timeout,
+                    id=0xFE, id_address_length_list=id_address_length_list)
+            responses = self.decode_fast_status_packet(packet, spans)
+            if self.fast_read_succeeded(packet, responses):
+                return responses
+
+        responses = await self.transact("inst_bulk_read", _timeout=timeout,
+                id=0xFE, id_address_length_list=id_address_length_list)
+        return self.decode_status_packets(responses, spans)
+
+    async def bulk_write_async(self, specs):
+        if len(specs) == 0:
+            return None
+        packet = await self.transact("inst_bulk_write", id=0xFE, id_address_length_data_list=self.build_bulk_write(specs))
+        self.store_bulk_values(specs)
+        return packet
@@ -0,0 +1,110 @@
+import perilib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .RobotisDynamixel2Protocol import *
+
+class RobotisDynamixel2BatchDecoder():
+
+    type_dtypes = {
+        "uint8": "u1", "int8": "i1",
+        "uint16": "<u2", "int16": "<i2",
+        "uint32": "<u4", "int32": "<i4",
+    }
+
+    def __init__(self, control_table_class, field_names=None, scales=None, indirect_map=None):
+        if numpy is None:
+            raise perilib.PerilibProtocolException("numpy is required for batch decoding")
+        self.control_table_class = control_table_class
+
+        # one record per servo covering the span of the requested fields (the
+        # standard table area by default), with every named field at its offset; pass
+        # the servos' indirect map when reads of these fields go through it
+        # (as Device.sync_read does when every servo's map covers them)
+        if field_names is None:
+            (self.address, self.length) = control_table_class.get_standard_span()
+            fields = [field for field in control_table_class.get_fields_in_range(self.address, self.length)
+                    if "___" not in field["name"]]
+        else:
+            fields = [control_table_class.get_field_info(field_name) for field_name in field_names]
+        if indirect_map is not None:
+            if field_names is None or not indirect_map.covers(field_names):
+                raise perilib.PerilibProtocolException("Indirect map does not cover every decoded field")
+            (self.address, self.length) = indirect_map.get_span(field_names)
+            offsets = [indirect_map.address + indirect_map.entries[field["name"]][0] - self.address for field in fields]
+        else:
+            if field_names is not None:
+                (self.address, self.length) = control_table_class.get_span(field_names)
+            offsets = [field["address"] - self.address for field in fields]
+        self.field_names = [field["name"] for field in fields]
+        self.dtype = numpy.dtype({
+            "names": self.field_names,
+            "formats": [self.type_dtypes[field["type"]] for field in fields],
+            "offsets": offsets,
+            "itemsize": self.length,
+        })
+
+        # fast_sync_read segments are [error, ID, data, CRC], so the combined
+        # reply is an array of these records right after the status header
+        # (named segment_* because "id" is also a control table field)
+        self.fast_dtype = numpy.dtype({
+            "names": ["segment_error", "segment_id"] + self.field_names,
+            "formats": ["u1", "u1"] + [self.type_dtypes[field["type"]] for field in fields],
+            "offsets": [0, 1] + [offset + 2 for offset in offsets],
+            "itemsize": self.length + 4,
+        })
+
+        # raw unit -> SI scale factors, overridable for models whose units differ
+        self.scales = dict(control_table_class.si_scales)
+        if scales is not None:
+            self.scales.update(scales)
+
+    def decode(self, buffer, count=-1):
+        # stacked buffer of N equally sized servo payloads -> N records
+        return numpy.frombuffer(buffer, dtype=self.dtype, count=count)
+
+    def decode_responses(self, responses):
+        # { servo ID: status packet or None } from sync_read -> (IDs, records)
+        # for servos that answered
+        ids = [id for id, packet in responses.items() if packet is not None]
+        if len(ids) > 0 and responses[ids[0]].name == "stat_fast_sync_read":
+            # replies to fast reads all share one packet
+            return self.decode_fast(responses[ids[0]], ids)
+        for id in ids:
+            if len(responses[id].data) != self.length:
+                # read a different span than this decoder's layout describes
+                raise perilib.PerilibProtocolException(
+                        "Servo %d returned %d bytes, decoder expects %d (read through an indirect map?)"
+                        % (id, len(responses[id].data), self.length))
+        return (numpy.array(ids, dtype=numpy.uint8), self.decode(b"".join([responses[id].data for id in ids])))
+
+    def decode_fast(self, packet, ids):
+        # the splitter checks every segment's CRC; segments reporting an
+        # error (other than the hardware alert bit) carry no valid data
+        buffer = packet.buffer
+        segments = RobotisDynamixel2Protocol.split_fast_status(buffer, dict.fromkeys(ids, self.length))
+        if len(segments) != len(ids):
+            # the device already found these segments with its own spans, so
+            # this layout must describe a different span
+            raise perilib.PerilibProtocolException(
+                    "Fast read segments do not match the decoder's %d byte layout (read through an indirect map?)"
+                    % self.length)
+        ids = [id for id in ids if segments[id][0] & 0x7F == 0]
+
+        # every segment good and no stuffing: decode in place, else join the
+        # segments first
+        if len(ids) == len(segments) and len(buffer) - 8 == len(ids) * (self.length + 4):
+            records = numpy.frombuffer(buffer, dtype=self.fast_dtype, offset=8)
+            return (records["segment_id"], records[self.field_names])
+        return (numpy.array(ids, dtype=numpy.uint8), self.decode(b"".join([bytes(segments[id][1]) for id in ids])))
+
+    def convert(self, records, field_names=None):
+        # vectorized raw -> SI conversion, one float array per field (fields
+        # without a known scale are returned unscaled)
+        converted = {}
+        for field_name in field_names if field_names is not None else self.field_names:
+            converted[field_name] = records[field_name] * self.scales.get(field_name, 1.0)
+        return converted
@@ -0,0 +1,147 @@
+import concurrent.futures
+import time
+import perilib
+
+from .RobotisDynamixel2Device import *
+
+class RobotisDynamixel2BusSnapshot():
+
+    def __init__(self, timestamp, duration, responses, values):
+        # wall clock time the group operation started, plus how long it took
+        # (measured on a monotonic clock)
+        self.timestamp = timestamp
+        self.duration = duration
+
+        # servo ID -> status packet (None if missing), and servo ID ->
+        # { field name: value } for the fields that were read
+        self.responses = responses
+        self.values = values
+
+    def __getitem__(self, id):
+        return self.values[id]
+
+    def __str__(self):
+        return "snapshot @ %.06f (%.03f ms, %d servo(s))" % (self.timestamp, self.duration * 1000, len(self.values))
+
+class RobotisDynamixel2BusGroup():
+
+    def __init__(self, devices=None):
+        self.devices = []
+        self.workers = {}
+
+        # servo ID -> device, servo IDs must be unique across the whole group
+        self.servo_devices = {}
+        for device in devices if devices is not None else []:
+            self.add_device(device)
+
+    def add_device(self, device):
+        # every bus gets its own I/O worker so buses run in parallel, while
+        # operations on one bus still run one after another
+        self.devices.append(device)
+        try:
+            self.update_servo_map()
+        except perilib.PerilibProtocolException:
+            self.devices.remove(device)
+            raise
+        self.workers[device] = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def remove_device(self, device):
+        self.devices.remove(device)
+        self.workers.pop(device).shutdown(wait=False)
+        self.update_servo_map()
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.shutdown(wait=True)
+        self.workers = {}
+        self.devices = []
+        self.servo_devices = {}
+
+    def update_servo_map(self):
+        servo_devices = {}
+        for device in self.devices:
+            for id in device.servos:
+                if id in servo_devices:
+                    raise perilib.PerilibProtocolException(
+                            "Servo ID %d found on both '%s' and '%s'" % (id, servo_devices[id], device))
+                servo_devices[id] = device
+        self.servo_devices = servo_devices
+
+    @property
+    def servos(self):
+        return { id: device.servos[id] for id, device in self.servo_devices.items() }
+
+    def split(self, items):
+        # group per-servo items (IDs, or a dict keyed by ID) by owning bus
+        parts = {}
+        for id in items:
+            if id not in self.servo_devices:
+                raise perilib.PerilibProtocolException("Servo ID %d is not on any bus in this group" % id)
+            device = self.servo_devices[id]
+            if isinstance(items, dict):
+                parts.setdefault(device, {})[id] = items[id]
+            else:
+                parts.setdefault(device, []).append(id)
+        return parts
+
+    def run(self, calls):
+        # calls maps device -> (function, args); all buses start together and
+        # the slowest one sets the total time
+        futures = { device: self.workers[device].submit(function, *args) for device, (function, args) in calls.items() }
+        concurrent.futures.wait(futures.values())
+
+        # raise the first bus failure only after every bus has finished
+        return { device: future.result() for device, future in futures.items() }
+
+    def scan(self):
+        self.run({ device: (device.scan, ()) for device in self.devices })
+        self.update_servo_map()
+        return len(self.servo_devices)
+
+    def sync_read(self, field_names, servo_ids=None, timeout=None):
+        # one sync_read per bus, covering only the servos on that bus
+        if servo_ids is None:
+            servo_ids = sorted(self.servo_devices)
+        timestamp = time.time()
+        started = time.perf_counter()
+        results = self.run({ device: (device.sync_read, (field_names, ids, timeout))
+                for device, ids in self.split(servo_ids).items() })
+        return self.merge(timestamp, started, results, { id: field_names for id in servo_ids })
+
+    def bulk_read(self, specs, timeout=None):
+        # specs maps servo ID -> (address, length) or a list of field names
+        timestamp = time.time()
+        started = time.perf_counter()
+        results = self.run({ device: (device.bulk_read, (part, timeout))
+                for device, part in self.split(specs).items() })
+        return self.merge(timestamp, started, results, specs)
+
+    def sync_write(self, field_name, values):
+        return self.run({ device: (device.sync_write, (field_name, part))
+                for device, part in self.split(values).items() })
+
+    def bulk_write(self, specs):
+        return self.run({ device: (device.bulk_write, (part,))
+                for device, part in self.split(specs).items() })
+
+    def merge(self, timestamp, started, results, specs):
+        duration = time.perf_counter() - started
+        responses = {}
+        values = {}
+        for device, device_responses in results.items():
+            responses.update(device_responses)
+            for id, packet in device_responses.items():
+                if packet is None:
+                    continue
+
+                # read fields back out of the servo's freshly updated control table
+                control_table = device.servos[id].control_table
+                spec = specs[id]
+                if len(spec) > 0 and isinstance(spec[0], str):
+                    field_names = spec
+                else:
+                    field_names = [field["name"] for field in control_table.get_fields_in_range(*spec)
+                            if "___" not in field["name"]]
+                values[id] = { field_name: control_table[field_name] for field_name in field_names }
+
+        return RobotisDynamixel2BusSnapshot(timestamp, duration, responses, values)
@@ -1,51 +1,368 @@
+import math
+import struct
 import perilib
 
+class ControlTableField():
+    
+    # descriptor that decodes one field from the raw table image on access
+    __slots__ = ("name", "address", "codec")
+    
+    def __init__(self, name, address, codec):
+        self.name = name
+        self.address = address
+        self.codec = codec
+        
+    def __get__(self, table, owner=None):
+        if table is None:
+            return self
+        return table.get_value_at(self.address, self.codec)
+        
+    def __set__(self, table, value):
+        table.set_value(self.name, value)
+        
 class ControlTable():
     
     size = 0
     fields = []
     
+    # bytes covered by a full-table read; tables with an optional block past
+    # the standard area (X-series indirect addressing) set this below size
+    standard_size = None
+    
+    type_sizes = {
+        "uint8": 1, "int8": 1,
+        "uint16": 2, "int16": 2,
+        "uint32": 4, "int32": 4,
+    }
+    
+    type_formats = {
+        "uint8": "B", "int8": "b",
+        "uint16": "H", "int16": "h",
+        "uint32": "I", "int32": "i",
+    }
+    
+    # raw unit -> SI scale factor per field name (see ControlTableX)
+    si_scales = {}
+    
+    # compiled codecs, built once per subclass by __init_subclass__
+    _field_index = {}
+    _range_spans = {}
+    
+    # raw table image plus per-byte flags marking which bytes hold real data
+    # and which have local changes not yet written to the servo
+    __slots__ = ("_raw", "_valid", "_dirty", "write_back")
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.compile_fields()
+    
     def __init__(self, buffer=None):
+        # create empty table for replacement or selective updates later
+        self._raw = bytearray(self.size)
+        self._valid = bytearray(self.size)
+        self._dirty = bytearray(self.size)
+        
+        # when enabled, assignments are staged for flush() instead of only
+        # updating local data
+        self.write_back = False
+            
         if buffer is not None:
-            # create dictionary from buffer
+            # fill table from buffer
             self.populate_data_from_buffer(buffer)
-        else:
-            # create empty table for replacement or selective updates later
-            self._data = {}
-            for field in self.fields:
-                self._data[field["name"]] = None
 
     def __getitem__(self, arg):
-        return self._data[arg]
+        (field, codec) = self._field_index[arg]
+        return self.get_value_at(field["address"], codec)
     
-    def __getattr__(self, arg):
-        if arg in self.__dict__:
-            return self.__dict__[arg]
-        else:
-            return self._data[arg]
+    def __setitem__(self, arg, value):
+        self.set_value(arg, value)
     
     def __str__(self):
         lines = []
         for field in self.fields:
             if "___" not in field["name"]:
-                if self._data[field["name"]] is None:
+                value = self[field["name"]]
+                if value is None:
                     lines.append("%22s: None" % (field["name"]))
                 else:
-                    lines.append("%22s: %d" % (field["name"], self._data[field["name"]]))
+                    lines.append("%22s: %d" % (field["name"], value))
         return '\n'.join(lines)
         
-    def populate_data_from_buffer(self, buffer):
-        self._data = perilib.StreamProtocol.unpack_values(buffer, self.fields)
+    def get_value_at(self, address, codec):
+        # fields that were never read (or only partially read) decode as None
+        if not self._valid[address] or not self._valid[address + codec.size - 1]:
+            return None
+        return codec.unpack_from(self._raw, address)[0]
+        
+    def populate_data_from_buffer(self, buffer, address=0):
+        # copy only fields entirely inside the given range (the full table if
+        # the buffer starts at address 0 and covers everything); decoding
+        # happens later, when a field is accessed
+        (offset, size) = self.get_range_span(address, len(buffer))
+        start = address + offset
+        self._raw[start:start + size] = memoryview(buffer)[offset:offset + size]
+        self._valid[start:start + size] = b"\x01" * size
+        
+    def store_value(self, field_name, value):
+        # update local data only (e.g. after a successful write)
+        (field, codec) = self._field_index[field_name]
+        codec.pack_into(self._raw, field["address"], value)
+        self._valid[field["address"]:field["address"] + codec.size] = b"\x01" * codec.size
+        
+    def store_values(self, values):
+        for field_name, value in values.items():
+            self.store_value(field_name, value)
+            
+    def set_value(self, field_name, value):
+        # attribute/item assignment, staged for writing in write-back mode
+        if self.write_back:
+            return self.stage_value(field_name, value)
+        self.store_value(field_name, value)
+        return True
         
-    def get_field_info(self, field_name):
+    def stage_value(self, field_name, value):
+        # update local data and mark it dirty, unless it already holds this
+        # exact value
+        (field, codec) = self._field_index[field_name]
+        address = field["address"]
+        data = codec.pack(value)
+        if self.get_data(address, codec.size) == data:
+            return False
+        self._raw[address:address + codec.size] = data
+        self._valid[address:address + codec.size] = b"\x01" * codec.size
+        self._dirty[address:address + codec.size] = b"\x01" * codec.size
+        return True
+        
+    @property
+    def dirty(self):
+        return b"\x01" in self._dirty
+        
+    def clear_dirty(self, address=0, length=None):
+        if length is None:
+            length = self.size - address
+        self._dirty[address:address + length] = bytes(length)
+        
+    def get_dirty_spans(self, gap=0):
+        # merge dirty fields into as few contiguous (address, length) spans as
+        # possible; clean fields up to `gap` bytes long between two dirty ones
+        # are rewritten with their known values if they are writable
+        spans = []
+        bridgeable = False
         for field in self.fields:
-            if field["name"] == field_name:
-                return field
-        return None
+            address = field["address"]
+            size = self.get_field_size(field)
+            if self._dirty[address]:
+                if bridgeable and field["eeprom"] == spans[-1][2] \
+                        and address - spans[-1][0] - spans[-1][1] <= gap:
+                    spans[-1][1] = address + size - spans[-1][0]
+                else:
+                    spans.append([address, size, field["eeprom"]])
+                bridgeable = True
+            elif bridgeable:
+                # never span EEPROM and RAM, reserved or read-only bytes, or
+                # bytes whose value is unknown
+                bridgeable = field["writable"] and "___" not in field["name"] \
+                        and field["eeprom"] == spans[-1][2] \
+                        and self.get_data(address, size) is not None
+        spans = [(address, length) for (address, length, eeprom) in spans]
+        
+        # EEPROM writes only work with torque off: write a span that disables
+        # torque first, and one that enables it last
+        if "torque_enable" in self._field_index:
+            (field, codec) = self._field_index["torque_enable"]
+            address = field["address"]
+            if self._dirty[address]:
+                span = [span for span in spans if span[0] <= address < span[0] + span[1]][0]
+                spans.remove(span)
+                if self.get_value_at(address, codec):
+                    spans.append(span)
+                else:
+                    spans.insert(0, span)
+        return spans
+            
+    def snapshot(self):
+        # immutable copy of the raw table image
+        return bytes(self._raw)
+        
+    def get_data(self, address, length):
+        # raw bytes of a range, or None unless every byte in it holds real data
+        if b"\x00" in self._valid[address:address + length]:
+            return None
+        return bytes(self._raw[address:address + length])
+        
+    def copy(self):
+        table = self.__class__()
+        table._raw[:] = self._raw
+        table._valid[:] = self._valid
+        table._dirty[:] = self._dirty
+        table.write_back = self.write_back
+        return table
+        
+    @classmethod
+    def compile_fields(cls):
+        # name -> (field, struct) index for single fields
+        cls._field_index = {}
+        for field in cls.fields:
+            codec = struct.Struct("<" + cls.get_field_format(field))
+            cls._field_index[field["name"]] = (field, codec)
+            setattr(cls, field["name"], ControlTableField(field["name"], field["address"], codec))
+        cls._range_spans = {}
+        
+    @classmethod
+    def get_range_span(cls, address, length):
+        # (offset into the range, byte count) of the whole fields inside an
+        # address range, cached per range
+        key = (address, length)
+        if key not in cls._range_spans:
+            fields = cls.get_fields_in_range(address, length)
+            if len(fields) == 0:
+                cls._range_spans[key] = (0, 0)
+            else:
+                end = fields[-1]["address"] + cls.get_field_size(fields[-1])
+                cls._range_spans[key] = (fields[0]["address"] - address, end - fields[0]["address"])
+        return cls._range_spans[key]
+        
+    @classmethod
+    def get_field_info(cls, field_name):
+        entry = cls._field_index.get(field_name)
+        return entry[0] if entry is not None else None
+        
+    @classmethod
+    def pack_value(cls, field_name, value):
+        entry = cls._field_index.get(field_name)
+        if entry is None:
+            raise perilib.PerilibProtocolException(
+                    "Unable to locate control table field '%s'" % field_name)
+        return entry[1].pack(value)
+        
+    @classmethod
+    def get_field_size(cls, field):
+        if field["type"] == "uint8a-fixed":
+            return field["width"]
+        return ControlTable.type_sizes[field["type"]]
+        
+    @classmethod
+    def get_field_format(cls, field):
+        # little-endian struct format character(s) for a single field
+        if field["type"] == "uint8a-fixed":
+            return "%ds" % field["width"]
+        return ControlTable.type_formats[field["type"]]
+        
+    @classmethod
+    def get_fields_in_range(cls, address, length):
+        # fields are stored in address order with no gaps, so this is contiguous
+        return [field for field in cls.fields
+                if field["address"] >= address
+                and field["address"] + cls.get_field_size(field) <= address + length]
+        
+    @classmethod
+    def get_region_span(cls, region):
+        # (address, length) covering the whole "eeprom" or "ram" area
+        if region not in ("eeprom", "ram"):
+            raise perilib.PerilibProtocolException(
+                    "Unknown control table region '%s'" % region)
+        end = cls.get_standard_span()[1]
+        fields = [field for field in cls.fields if bool(field["eeprom"]) == (region == "eeprom") and field["address"] < end]
+        if len(fields) == 0:
+            return (0, 0)
+        return (fields[0]["address"], fields[-1]["address"] + cls.get_field_size(fields[-1]) - fields[0]["address"])
+        
+    @classmethod
+    def get_standard_span(cls):
+        return (0, cls.standard_size if cls.standard_size is not None else cls.size)
+        
+    @classmethod
+    def get_span(cls, field_names):
+        # find the smallest contiguous (address, length) range covering all fields
+        start = None
+        end = None
+        for field_name in field_names:
+            field = cls.get_field_info(field_name)
+            if field is None:
+                raise perilib.PerilibProtocolException(
+                        "Unable to locate control table field '%s'" % field_name)
+            field_end = field["address"] + cls.get_field_size(field)
+            if start is None or field["address"] < start:
+                start = field["address"]
+            if end is None or field_end > end:
+                end = field_end
+        if start is None:
+            raise perilib.PerilibProtocolException("No control table fields specified")
+        return (start, end - start)
+        
+    @classmethod
+    def get_spans(cls, field_names, gap=0):
+        # like get_span(), but split into several ranges wherever more than
+        # `gap` unwanted bytes separate two requested fields
+        spans = []
+        for field_name in sorted(set(field_names), key=lambda name: cls.get_span([name])[0]):
+            (address, length) = cls.get_span([field_name])
+            if len(spans) > 0 and address - spans[-1][0] - spans[-1][1] <= gap:
+                spans[-1][1] = max(spans[-1][1], address + length - spans[-1][0])
+            else:
+                spans.append([address, length])
+        if len(spans) == 0:
+            raise perilib.PerilibProtocolException("No control table fields specified")
+        return [(address, length) for (address, length) in spans]
+        
+    @classmethod
+    def get_region_fields(cls, region):
+        # names of all real (non-reserved) fields in the "eeprom" or "ram" area
+        (address, length) = cls.get_region_span(region)
+        return [field["name"] for field in cls.get_fields_in_range(address, length) if "___" not in field["name"]]
+        
+    @classmethod
+    def get_block(cls, field_names):
+        # (address, length, fields in address order) for fields that must be
+        # written together as one contiguous block
+        (address, length) = cls.get_span(field_names)
+        fields = sorted([cls.get_field_info(name) for name in field_names], key=lambda field: field["address"])
+        if sum([cls.get_field_size(field) for field in fields]) != length:
+            raise perilib.PerilibProtocolException(
+                    "Fields %s do not form a contiguous block" % ", ".join([field["name"] for field in fields]))
+        return (address, length, fields)
+        
+    @classmethod
+    def get_block_format(cls, fields):
+        return "".join([cls.get_field_format(field) for field in fields])
         
 class ControlTableX(ControlTable):
     
-    size = 147
+    __slots__ = ()
+    
+    size = 244
+    
+    # addresses 0-147; the indirect address/data block above is only read
+    # when an indirect map uses it
+    standard_size = 148
+    
+    # positions in rad, velocities in rad/s, currents in A (2.69 mA units as on
+    # XM430/XM540; XH430 uses 1.34 mA), voltages in V, temperatures in degrees
+    # C and PWM as a fraction of full duty
+    si_scales = {
+        "homing_offset": 2 * math.pi / 4096,
+        "max_position_limit": 2 * math.pi / 4096,
+        "min_position_limit": 2 * math.pi / 4096,
+        "goal_position": 2 * math.pi / 4096,
+        "present_position": 2 * math.pi / 4096,
+        "position_trajectory": 2 * math.pi / 4096,
+        "moving_threshold": 0.229 * 2 * math.pi / 60,
+        "velocity_limit": 0.229 * 2 * math.pi / 60,
+        "goal_velocity": 0.229 * 2 * math.pi / 60,
+        "present_velocity": 0.229 * 2 * math.pi / 60,
+        "velocity_trajectory": 0.229 * 2 * math.pi / 60,
+        "current_limit": 0.00269,
+        "goal_current": 0.00269,
+        "present_current": 0.00269,
+        "max_voltage_limit": 0.1,
+        "min_voltage_limit": 0.1,
+        "present_input_voltage": 0.1,
+        "temperature_limit": 1.0,
+        "present_temperature": 1.0,
+        "pwm_limit": 0.00113,
+        "goal_pwm": 0.00113,
+        "present_pwm": 0.00113,
+    }
     fields = [
         # EEPROM
         { "eeprom": 1,  "name": "model_number",             "type": "uint16",                       "address": 0,       "writable": 0 },
@@ -93,8 +410,8 @@ class ControlTableX(ControlTable):
         { "eeprom": 0,  "name": "___RESERVED07",            "type": "uint8a-fixed", "width": 6,     "address": 92,      "writable": 1 },
         { "eeprom": 0,  "name": "bus_watchdog",             "type": "uint8",                        "address": 98,      "writable": 1 },
         { "eeprom": 0,  "name": "___RESERVED08",            "type": "uint8a-fixed", "width": 1,     "address": 99,      "writable": 1 },
-        { "eeprom": 0,  "name": "goal_pwm",                 "type": "uint16",                       "address": 100,     "writable": 1 },
-        { "eeprom": 0,  "name": "goal_current",             "type": "uint16",                       "address": 102,     "writable": 1 },
+        { "eeprom": 0,  "name": "goal_pwm",                 "type": "int16",                        "address": 100,     "writable": 1 },
+        { "eeprom": 0,  "name": "goal_current",             "type": "int16",                        "address": 102,     "writable": 1 },
         { "eeprom": 0,  "name": "goal_velocity",            "type": "int32",                        "address": 104,     "writable": 1 },
         { "eeprom": 0,  "name": "profile_acceleration",     "type": "int32",                        "address": 108,     "writable": 1 },
         { "eeprom": 0,  "name": "profile_velocity",         "type": "int32",                        "address": 112,     "writable": 1 },
@@ -102,17 +419,60 @@ class ControlTableX(ControlTable):
         { "eeprom": 0,  "name": "realtime_tick",            "type": "uint16",                       "address": 120,     "writable": 0 },
         { "eeprom": 0,  "name": "moving",                   "type": "uint8",                        "address": 122,     "writable": 0 },
         { "eeprom": 0,  "name": "moving_status",            "type": "uint8",                        "address": 123,     "writable": 0 },
-        { "eeprom": 0,  "name": "present_pwm",              "type": "uint16",                       "address": 124,     "writable": 0 },
-        { "eeprom": 0,  "name": "present_current",          "type": "uint16",                       "address": 126,     "writable": 0 },
+        { "eeprom": 0,  "name": "present_pwm",              "type": "int16",                        "address": 124,     "writable": 0 },
+        { "eeprom": 0,  "name": "present_current",          "type": "int16",                        "address": 126,     "writable": 0 },
         { "eeprom": 0,  "name": "present_velocity",         "type": "int32",                        "address": 128,     "writable": 0 },
         { "eeprom": 0,  "name": "present_position",         "type": "int32",                        "address": 132,     "writable": 0 },
         { "eeprom": 0,  "name": "velocity_trajectory" ,     "type": "int32",                        "address": 136,     "writable": 0 },
         { "eeprom": 0,  "name": "position_trajectory",      "type": "int32",                        "address": 140,     "writable": 0 },
         { "eeprom": 0,  "name": "present_input_voltage",    "type": "uint16",                       "address": 144,     "writable": 0 },
         { "eeprom": 0,  "name": "present_temperature",      "type": "int8",                         "address": 146,     "writable": 0 },
+        { "eeprom": 0,  "name": "backup_ready",             "type": "uint8",                        "address": 147,     "writable": 0 },
+        { "eeprom": 0,  "name": "___RESERVED09",            "type": "uint8a-fixed", "width": 20,    "address": 148,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_1",       "type": "uint16",                       "address": 168,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_2",       "type": "uint16",                       "address": 170,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_3",       "type": "uint16",                       "address": 172,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_4",       "type": "uint16",                       "address": 174,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_5",       "type": "uint16",                       "address": 176,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_6",       "type": "uint16",                       "address": 178,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_7",       "type": "uint16",                       "address": 180,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_8",       "type": "uint16",                       "address": 182,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_9",       "type": "uint16",                       "address": 184,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_10",      "type": "uint16",                       "address": 186,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_11",      "type": "uint16",                       "address": 188,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_12",      "type": "uint16",                       "address": 190,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_13",      "type": "uint16",                       "address": 192,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_14",      "type": "uint16",                       "address": 194,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_15",      "type": "uint16",                       "address": 196,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_16",      "type": "uint16",                       "address": 198,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_17",      "type": "uint16",                       "address": 200,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_18",      "type": "uint16",                       "address": 202,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_19",      "type": "uint16",                       "address": 204,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_address_20",      "type": "uint16",                       "address": 206,     "writable": 1 },
+        { "eeprom": 0,  "name": "___RESERVED10",            "type": "uint8a-fixed", "width": 16,    "address": 208,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_1",          "type": "uint8",                        "address": 224,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_2",          "type": "uint8",                        "address": 225,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_3",          "type": "uint8",                        "address": 226,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_4",          "type": "uint8",                        "address": 227,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_5",          "type": "uint8",                        "address": 228,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_6",          "type": "uint8",                        "address": 229,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_7",          "type": "uint8",                        "address": 230,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_8",          "type": "uint8",                        "address": 231,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_9",          "type": "uint8",                        "address": 232,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_10",         "type": "uint8",                        "address": 233,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_11",         "type": "uint8",                        "address": 234,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_12",         "type": "uint8",                        "address": 235,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_13",         "type": "uint8",                        "address": 236,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_14",         "type": "uint8",                        "address": 237,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_15",         "type": "uint8",                        "address": 238,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_16",         "type": "uint8",                        "address": 239,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_17",         "type": "uint8",                        "address": 240,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_18",         "type": "uint8",                        "address": 241,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_19",         "type": "uint8",                        "address": 242,     "writable": 1 },
+        { "eeprom": 0,  "name": "indirect_data_20",         "type": "uint8",                        "address": 243,     "writable": 1 },
     ]
                 
 class ControlTablePro(ControlTable):
     
-    pass
+    __slots__ = ()
     
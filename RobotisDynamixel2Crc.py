@@ -0,0 +1,161 @@
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class RobotisDynamixel2Crc():
+
+    # CRC-16/IBM variant used by protocol 2.0: poly 0x8005, MSB-first, init 0
+    polynomial = 0x8005
+    
+    # known-answer vectors (frame without CRC, expected CRC) from the e-manual
+    known_answers = [
+        (bytes([0xFF, 0xFF, 0xFD, 0x00, 0x01, 0x03, 0x00, 0x01]), 0x4E19),
+        (bytes([0xFF, 0xFF, 0xFD, 0x00, 0x01, 0x07, 0x00, 0x55, 0x00, 0x06, 0x04, 0x26]), 0x5D65),
+        (bytes([0xFF, 0xFF, 0xFD, 0x00, 0x01, 0x07, 0x00, 0x02, 0x84, 0x00, 0x04, 0x00]), 0x151D),
+        (b"", 0x0000),
+    ]
+    
+    # tables[k][x] is the CRC of byte x followed by k zero bytes, which lets
+    # the slicing backends fold several input bytes per table lookup round
+    tables = []
+    
+    backends = {}
+    backend_name = None
+    update_long = None
+    
+    # below this many bytes the setup of the slicing backends costs more than
+    # it saves (e.g. 2.75 us bytewise vs 3.3 us slicing-by-4 on a 14 byte
+    # frame), so short frames always use the bytewise loop
+    short_length = 20
+    
+    @classmethod
+    def build_tables(cls, count=8):
+        table = []
+        for i in range(256):
+            crc = i << 8
+            for bit in range(8):
+                crc = ((crc << 1) ^ cls.polynomial) if crc & 0x8000 else (crc << 1)
+            table.append(crc & 0xFFFF)
+        cls.tables = [table]
+        for k in range(1, count):
+            previous = cls.tables[k - 1]
+            cls.tables.append([((previous[x] & 0xFF) << 8) ^ table[previous[x] >> 8] for x in range(256)])
+            
+    @classmethod
+    def update_bytewise(cls, crc_accum, data_blk):
+        # reference implementation, one table lookup per byte
+        table = cls.tables[0]
+        for b in data_blk:
+            crc_accum = ((crc_accum << 8) ^ table[((crc_accum >> 8) ^ b) & 0xFF]) & 0xFFFF
+        return crc_accum
+        
+    @classmethod
+    def update_slicing_by_4(cls, crc_accum, data_blk):
+        (t0, t1, t2, t3) = cls.tables[0:4]
+        data_blk = memoryview(data_blk).cast("B")
+        tail = len(data_blk) & ~3
+        chunks = iter(data_blk[:tail])
+        for (b0, b1, b2, b3) in zip(chunks, chunks, chunks, chunks):
+            crc_accum = t3[(crc_accum >> 8) ^ b0] ^ t2[(crc_accum & 0xFF) ^ b1] ^ t1[b2] ^ t0[b3]
+        for b in data_blk[tail:]:
+            crc_accum = ((crc_accum << 8) ^ t0[((crc_accum >> 8) ^ b) & 0xFF]) & 0xFFFF
+        return crc_accum
+        
+    @classmethod
+    def update_slicing_by_8(cls, crc_accum, data_blk):
+        (t0, t1, t2, t3, t4, t5, t6, t7) = cls.tables[0:8]
+        data_blk = memoryview(data_blk).cast("B")
+        tail = len(data_blk) & ~7
+        chunks = iter(data_blk[:tail])
+        for (b0, b1, b2, b3, b4, b5, b6, b7) in zip(chunks, chunks, chunks, chunks, chunks, chunks, chunks, chunks):
+            crc_accum = t7[(crc_accum >> 8) ^ b0] ^ t6[(crc_accum & 0xFF) ^ b1] \
+                    ^ t5[b2] ^ t4[b3] ^ t3[b4] ^ t2[b5] ^ t1[b6] ^ t0[b7]
+        for b in data_blk[tail:]:
+            crc_accum = ((crc_accum << 8) ^ t0[((crc_accum >> 8) ^ b) & 0xFF]) & 0xFFFF
+        return crc_accum
+        
+    @classmethod
+    def update(cls, crc_accum, data_blk):
+        if len(data_blk) < cls.short_length:
+            return cls.update_bytewise(crc_accum, data_blk)
+        return cls.update_long(crc_accum, data_blk)
+        
+    @classmethod
+    def calculate_batch(cls, frames):
+        # CRC of many frames at once; with NumPy, all frames advance one byte
+        # column per step (frames are left-padded with zeros, which does not
+        # change a CRC that starts from 0)
+        if numpy is None or len(frames) == 0:
+            return [cls.update(0, frame) for frame in frames]
+            
+        width = max([len(frame) for frame in frames])
+        columns = numpy.zeros((len(frames), width), dtype=numpy.uint8)
+        for row, frame in enumerate(frames):
+            if len(frame) > 0:
+                columns[row, width - len(frame):] = numpy.frombuffer(frame, dtype=numpy.uint8)
+        table = numpy.array(cls.tables[0], dtype=numpy.uint16)
+        crc = numpy.zeros(len(frames), dtype=numpy.uint16)
+        for column in range(width):
+            crc = (crc << 8) ^ table[(crc >> 8) ^ columns[:, column]]
+        return crc.tolist()
+        
+    @classmethod
+    def verify_backend(cls, update):
+        # check a backend against the known answers and the reference loop
+        for (frame, crc) in cls.known_answers:
+            if update(0, frame) != crc:
+                return False
+        sample = bytes([(i * 37 + 11) & 0xFF for i in range(517)])
+        for length in range(0, 40):
+            if update(0x1234, sample[:length]) != cls.update_bytewise(0x1234, sample[:length]):
+                return False
+        return update(0, sample) == cls.update_bytewise(0, sample)
+        
+    @classmethod
+    def set_backend(cls, name, short_length=None):
+        # backend for frames of at least short_length bytes
+        if name not in cls.backends:
+            raise ValueError("Unknown CRC backend '%s'" % name)
+        cls.backend_name = name
+        cls.update_long = cls.backends[name]
+        if short_length is not None:
+            cls.short_length = short_length
+            
+    @classmethod
+    def select_fastest_backend(cls, frame_lengths=(8, 14, 20, 32, 64, 128, 256), rounds=200):
+        # time every backend that passes verification over the range of frame
+        # sizes seen on the bus (pings and single-field reads are 10-20 bytes,
+        # group reads run to hundreds), then use the backend that wins on the
+        # longest frames from the shortest length where it beats bytewise
+        timings = {}
+        for name, update in cls.backends.items():
+            if not cls.verify_backend(update):
+                continue
+            timings[name] = {}
+            for length in frame_lengths:
+                sample = bytes([(i * 37 + 11) & 0xFF for i in range(length)])
+                started = time.perf_counter()
+                for i in range(rounds):
+                    update(0, sample)
+                timings[name][length] = time.perf_counter() - started
+        longest = max(frame_lengths)
+        name = min(timings, key=lambda name: timings[name][longest])
+        short_length = longest + 1 if name == "bytewise" else longest
+        if "bytewise" in timings:
+            for length in sorted(frame_lengths, reverse=True):
+                if timings[name][length] >= timings["bytewise"][length]:
+                    break
+                short_length = length
+        cls.set_backend(name, short_length)
+        return timings
+        
+RobotisDynamixel2Crc.build_tables()
+RobotisDynamixel2Crc.backends = {
+    "bytewise": RobotisDynamixel2Crc.update_bytewise,
+    "slicing-by-4": RobotisDynamixel2Crc.update_slicing_by_4,
+    "slicing-by-8": RobotisDynamixel2Crc.update_slicing_by_8,
+}
+RobotisDynamixel2Crc.set_backend("slicing-by-4")
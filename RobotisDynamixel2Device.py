@@ -1,18 +1,68 @@
+import struct
+import threading
+import time
 import perilib
 
+from .RobotisDynamixel2Protocol import *
 from .RobotisDynamixel2Servo import *
+from .RobotisDynamixel2PacketTemplate import *
+from .RobotisDynamixel2Transaction import *
+from .RobotisDynamixel2Telemetry import *
 
 class RobotisDynamixel2Device(perilib.StreamDevice):
     
-    def __init__(self, id, port):
+    # factory default baud rate of X-series servos
+    default_baudrate = 57600
+    
+    # broadcast ping replies come back in ID order, one slot per possible ID:
+    # ping status packet length in bytes, extra time per slot and fixed margin
+    # for USB-serial latency (same margins as the Robotis SDK)
+    ping_status_length = 14
+    ping_slot_delay = 0.003
+    ping_latency = 0.016
+    
+    # cost of one extra read transaction: read instruction (14 bytes) plus
+    # status overhead (11 bytes) on the wire, and the turnaround time between
+    # them (servo return delay plus USB-serial latency)
+    read_packet_overhead = 25
+    read_turnaround = 0.001
+    
+    # status error number for an instruction the firmware does not know, and
+    # how many fast reads in a row may go unanswered before a servo falls
+    # back to classic reads
+    instruction_error = 0x02
+    fast_read_max_failures = 3
+    
+    def __init__(self, id, port, baudrate=None):
         super().__init__(id, port)
+        self.baudrate = baudrate if baudrate is not None else self.default_baudrate
         self.is_scanned = False
         self.servos = {}
+        
+        # held for every bus transaction (reentrant, so grouped calls may nest),
+        # keeping BusGroup workers, telemetry and the caller off each other's
+        # replies; hold it around several calls that must not be interleaved.
+        # The transaction queue (submit()) only transmits while it is free,
+        # but cannot hold it until replies arrive because those are handled on
+        # the reader thread, so wait for submitted futures before starting a
+        # blocking transaction from another thread
+        self.bus_lock = threading.RLock()
+        self.telemetry = None
+        
+        # reg_write staging: servo ID -> { field name: value } not yet sent,
+        # and servo ID -> values registered on the servo awaiting action
+        self.staged = {}
+        self.registered = {}
+        self.transactions = RobotisDynamixel2TransactionQueue(self)
     
     def attach_stream(self, stream):
         stream.parser_generator.on_rx_packet = self.on_rx_packet
     
     def on_rx_packet(self, packet):
+        # hand status packets to any queued transaction waiting for them
+        if packet.type == RobotisDynamixel2Packet.TYPE_STATUS:
+            self.transactions.on_rx_packet(packet)
+            
         if packet.name == "stat_ping":
             # add servo to internal list if not already present
             if packet.metadata["id"] not in self.servos:
@@ -22,19 +72,481 @@ class RobotisDynamixel2Device(perilib.StreamDevice):
                         firmware_version=packet["firmware_version"],
                         device=self)
 
+    def submit(self, _packet_name, _callback=None, **kwargs):
+        # queue an instruction and return a future for its reply/replies
+        return self.transactions.submit(_packet_name, _callback, **kwargs)
+
     def broadcast_packet(self, _packet_name, **kwargs):
         return self.stream.parser_generator.send_packet(_packet_name, id=0xFE, **kwargs)
         
-    def wait_packet(self, _packet_name=None):
-        return self.stream.parser_generator.wait_packet(_packet_name)
+    def wait_packet(self, _packet_name=None, _timeout=None):
+        if _timeout is None:
+            return self.stream.parser_generator.wait_packet(_packet_name)
+        return self.stream.parser_generator.wait_packet(_packet_name, _timeout=_timeout)
        
-    def scan(self):
-        # send ping instruction to entire bus
+    def scan(self, max_id=None, expected_count=None, expected_ids=None, baudrates=None):
+        with self.bus_lock:
+            if max_id is None and expected_count is None and expected_ids is None and baudrates is None:
+                # send ping instruction to entire bus
+                self.broadcast_packet("inst_ping")
+                
+                # wait for ping status replies until we time out
+                while self.wait_packet("stat_ping") is not None: pass
+            else:
+                # try each baud rate in turn until the expected servos are all
+                # found at one rate, else stay on the first rate where any servo
+                # answered (or the starting rate if none did)
+                original_baudrate = self.baudrate
+                known_ids = set(self.servos)
+                found = {}
+                found_baudrate = None
+                for baudrate in baudrates if baudrates is not None else [self.baudrate]:
+                    self.set_baudrate(baudrate)
+                    found[baudrate] = self.scan_window(max_id if max_id is not None else 252, expected_count, expected_ids)
+                    if self.scan_satisfied(found[baudrate], expected_count, expected_ids):
+                        found_baudrate = baudrate
+                        break
+                    if len(found[baudrate]) > 0 and found_baudrate is None:
+                        found_baudrate = baudrate
+                if found_baudrate is None:
+                    found_baudrate = original_baudrate
+                if found_baudrate != self.baudrate:
+                    self.set_baudrate(found_baudrate)
+                    
+                # servos that only answered at another rate are unreachable now
+                for baudrate, ids in found.items():
+                    if baudrate != found_baudrate:
+                        for id in ids - found.get(found_baudrate, set()) - known_ids:
+                            del self.servos[id]
+            
+            # mark as scanned and return servo count
+            self.is_scanned = True
+            return len(self.servos)
+        
+    def scan_window(self, max_id, expected_count=None, expected_ids=None):
+        # broadcast ping and collect replies until every ID slot up to max_id
+        # has passed, or the expected servos have all answered
         self.broadcast_packet("inst_ping")
+        slot = self.get_ping_slot_time()
+        deadline = time.monotonic() + (max_id + 1) * slot + self.ping_latency
+        ids = set()
+        while not self.scan_satisfied(ids, expected_count, expected_ids):
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            packet = self.wait_packet("stat_ping", _timeout=timeout)
+            if packet is None:
+                break
+                
+            # replies arrive in ID order, so only higher IDs can still answer
+            ids.add(packet.id)
+            deadline = time.monotonic() + max(max_id - packet.id, 0) * slot + self.ping_latency
+        return ids
+        
+    def scan_satisfied(self, ids, expected_count=None, expected_ids=None):
+        if expected_ids is not None:
+            return set(expected_ids) <= ids
+        return expected_count is not None and len(ids) >= expected_count
+        
+    def get_ping_slot_time(self):
+        # time on the wire for one ping status packet (10 bits per byte) plus
+        # the per-ID slot delay
+        return self.ping_status_length * 10 / self.baudrate + self.ping_slot_delay
+        
+    def get_read_merge_gap(self):
+        # unwanted bytes worth reading to save one extra read transaction at
+        # the current baud rate (10 bits per byte)
+        return self.read_packet_overhead + int(self.read_turnaround * self.baudrate / 10)
+        
+    def set_baudrate(self, baudrate):
+        # switch the host side of the bus; servo baud rates are not changed
+        self.baudrate = baudrate
+        port = getattr(self.stream, "serial", None)
+        if port is not None:
+            port.baudrate = baudrate
+            
+        # anything half-received belongs to the old baud rate
+        self.stream.parser_generator.framer.reset()
+        
+    def sync_read(self, field_names, servo_ids=None, timeout=None, fast=None):
+        with self.bus_lock:
+            (servo_ids, address, length, spans) = self.build_sync_read(field_names, servo_ids)
+            if len(servo_ids) == 0:
+                return {}
+                
+            # use fast_sync_read if every servo supports it, else fall back to classic
+            if fast is None:
+                fast = self.fast_read_supported(servo_ids)
+            if fast:
+                self.broadcast_packet("inst_fast_sync_read", address=address, length=length, id_list=bytes(servo_ids))
+                packet = self.wait_packet("stat_fast_sync_read", _timeout=timeout)
+                responses = self.decode_fast_status_packet(packet, spans)
+                if self.fast_read_succeeded(packet, responses):
+                    return responses
+
+            # send one instruction for all servos, then collect one status per servo
+            self.broadcast_packet("inst_sync_read", address=address, length=length, id_list=bytes(servo_ids))
+            return self.collect_status_packets("stat_sync_read", spans, timeout)
+        
+    def sync_write(self, field_name, values):
+        # values maps servo ID -> new value for the same field on each servo
+        with self.bus_lock:
+            if len(values) == 0:
+                return None
+                
+            # sync_write has no status reply, so just send it and update local data
+            packet = self.broadcast_packet("inst_sync_write", **self.build_sync_write(field_name, values))
+            self.store_values(field_name, values)
+            return packet
+        
+    def bulk_read(self, specs, timeout=None, fast=None):
+        with self.bus_lock:
+            (spans, id_address_length_list) = self.build_bulk_read(specs)
+            if len(spans) == 0:
+                return {}
+                
+            # use fast_bulk_read if every servo supports it, else fall back to classic
+            if fast is None:
+                fast = self.fast_read_supported(spans)
+            if fast:
+                self.broadcast_packet("inst_fast_bulk_read", id_address_length_list=id_address_length_list)
+                packet = self.wait_packet("stat_fast_bulk_read", _timeout=timeout)
+                responses = self.decode_fast_status_packet(packet, spans)
+                if self.fast_read_succeeded(packet, responses):
+                    return responses
+                    
+            # send one instruction for all servos, then collect one status per servo
+            self.broadcast_packet("inst_bulk_read", id_address_length_list=id_address_length_list)
+            return self.collect_status_packets("stat_bulk_read", spans, timeout)
+        
+    def bulk_write(self, specs):
+        # specs maps servo ID -> (field name, value) or { field name: value, ... }
+        with self.bus_lock:
+            if len(specs) == 0:
+                return None
+                
+            # bulk_write has no status reply, so just send it and update local data
+            packet = self.broadcast_packet("inst_bulk_write", id_address_length_data_list=self.build_bulk_write(specs))
+            self.store_bulk_values(specs)
+            return packet
+        
+    def flush(self, servo_ids=None):
+        # write-back mode: servos with identical dirty spans share one
+        # sync_write per span, the rest flush with their own writes
+        with self.bus_lock:
+            if servo_ids is None:
+                servo_ids = sorted(self.servos)
+            groups = {}
+            for id in servo_ids:
+                control_table = self.servos[id].control_table
+                spans = tuple(control_table.get_dirty_spans(self.servos[id].write_merge_gap))
+                if len(spans) > 0:
+                    groups.setdefault((type(control_table), spans), []).append(id)
+                    
+            results = {}
+            for (control_table_class, spans), ids in groups.items():
+                if len(ids) == 1:
+                    results[ids[0]] = self.servos[ids[0]].flush()
+                    continue
+                packets = []
+                for (address, length) in spans:
+                    id_data_list = b"".join([bytes([id]) + self.servos[id].control_table.get_data(address, length) for id in ids])
+                    packets.append(self.broadcast_packet("inst_sync_write", address=address, length=length, id_data_list=id_data_list))
+                    
+                    # sync_write has no status reply, so assume it was applied
+                    for id in ids:
+                        self.servos[id].control_table.clear_dirty(address, length)
+                for id in ids:
+                    results[id] = packets
+            return results
+        
+    def stage(self, servo_id, values):
+        # queue field values for one servo; nothing is sent until
+        # send_staged() or action()
+        self.staged.setdefault(servo_id, {}).update(values)
+        
+    def send_staged(self, servo_ids=None):
+        # register staged values on each servo with one reg_write (call this
+        # while the bus is otherwise idle); servos apply them on action()
+        if servo_ids is None:
+            servo_ids = sorted(self.staged)
+        results = {}
+        with self.bus_lock:
+            for id in servo_ids:
+                if id not in self.staged:
+                    continue
+                
+                # a servo holds only one registered instruction, so fold any
+                # values it already has registered into the same block
+                values = dict(self.registered.get(id, {}))
+                values.update(self.staged[id])
+                (address, data) = self.build_staged_block(id, values)
+                if id in self.servos and not self.servos[id].replies_to_writes():
+                    # no status reply will come, so count it as registered
+                    # once sent instead of waiting out the timeout
+                    packet = self.stream.parser_generator.send_packet("inst_reg_write", id=id, address=address, data=data)
+                    self.registered[id] = values
+                    del self.staged[id]
+                    results[id] = packet
+                    continue
+                packet = self.stream.parser_generator.send_and_wait("inst_reg_write", id=id, address=address, data=data)
+                if packet is not None and packet is not False and packet.error == 0:
+                    self.registered[id] = values
+                    del self.staged[id]
+                results[id] = packet
+        return results
+        
+    def action(self):
+        # register anything still staged, then latch every registered servo
+        # at once with a single broadcast action (no status reply)
+        with self.bus_lock:
+            if len(self.staged) > 0:
+                self.send_staged()
+            packet = self.broadcast_packet("inst_action")
+            
+            # mirror the values the servos have now applied
+            for id, values in self.registered.items():
+                if id in self.servos:
+                    self.servos[id].control_table.store_values(values)
+            self.registered = {}
+            return packet
+        
+    def build_staged_block(self, id, values):
+        # one contiguous (address, data) block for a reg_write; gaps between
+        # staged fields are filled with their known current values
+        control_table = self.servos[id].control_table
+        (address, length) = control_table.get_span(values)
+        data = bytearray(length)
+        for field in control_table.get_fields_in_range(address, length):
+            offset = field["address"] - address
+            size = control_table.get_field_size(field)
+            if field["name"] in values:
+                data[offset:offset + size] = control_table.pack_value(field["name"], values[field["name"]])
+                continue
+            known = control_table.get_data(field["address"], size)
+            if known is None or not field["writable"] or "___" in field["name"]:
+                raise perilib.PerilibProtocolException(
+                        "Cannot stage servo %d fields %s as one block, '%s' lies between them"
+                        % (id, ", ".join(values), field["name"]))
+            data[offset:offset + size] = known
+        return (address, bytes(data))
+        
+    def start_telemetry(self, field_names, servo_ids=None, rate=100.0, capacity=1000):
+        # poll the fields at a fixed rate on a worker thread into ring buffers
+        self.stop_telemetry()
+        self.telemetry = RobotisDynamixel2Telemetry(self, field_names, servo_ids, rate, capacity)
+        self.telemetry.start()
+        return self.telemetry
+        
+    def stop_telemetry(self):
+        if self.telemetry is not None:
+            self.telemetry.stop()
+            self.telemetry = None
+            
+    def build_sync_read(self, field_names, servo_ids=None):
+        # default to every known servo, in ID order
+        if servo_ids is None:
+            servo_ids = sorted(self.servos)
+        if len(servo_ids) == 0:
+            return (servo_ids, None, None, {})
+            
+        # all servos in one sync_read must share the same control table layout
+        # (and the same indirect map, if any); servos not scanned yet are
+        # assumed to use the layout of the first known one
+        control_table_class = self.get_control_table_class(servo_ids)
+        (address, length) = self.get_read_span(servo_ids[0], field_names, control_table_class)
+        for id in servo_ids[1:]:
+            if self.get_read_span(id, field_names, control_table_class) != (address, length):
+                (address, length) = control_table_class.get_span(field_names)
+                break
+        return (servo_ids, address, length, { id: (address, length) for id in servo_ids })
+        
+    def get_control_table_class(self, servo_ids):
+        # control table layout of the first known servo in the list, or of
+        # any known servo if none of them has been scanned
+        for id in list(servo_ids) + sorted(self.servos):
+            if id in self.servos:
+                return type(self.servos[id].control_table)
+        raise perilib.PerilibProtocolException(
+                "No known servo to take the control table layout from, scan first")
+                
+    def get_read_span(self, id, field_names, control_table_class=None):
+        # single span covering the fields, through the servo's indirect map
+        # when it mirrors all of them (unknown servos have no indirect map)
+        if id not in self.servos:
+            if control_table_class is None:
+                control_table_class = self.get_control_table_class([id])
+            return control_table_class.get_span(field_names)
+        servo = self.servos[id]
+        if servo.indirect_map is not None and servo.indirect_map.covers(field_names):
+            return servo.indirect_map.get_span(field_names)
+        return type(servo.control_table).get_span(field_names)
+        
+    def build_sync_write(self, field_name, values):
+        servo_ids = list(values)
+        control_table_class = type(self.servos[servo_ids[0]].control_table)
+        field = control_table_class.get_field_info(field_name)
+        if field is None:
+            raise perilib.PerilibProtocolException(
+                    "Unable to locate control table field '%s'" % field_name)
+                    
+        # pack every [ID, value] pair with a single struct call
+        id_data_format = "<" + ("B" + control_table_class.get_field_format(field)) * len(servo_ids)
+        return {
+            "address": field["address"],
+            "length": control_table_class.get_field_size(field),
+            "id_data_list": struct.pack(id_data_format, *[item for id in servo_ids for item in (id, values[id])])
+        }
+        
+    def build_bulk_read(self, specs):
+        # specs maps servo ID -> (address, length) or a list of field names
+        spans = {}
+        for id, spec in specs.items():
+            if len(spec) > 0 and isinstance(spec[0], str):
+                spans[id] = self.get_read_span(id, spec, self.get_control_table_class(specs))
+            else:
+                spans[id] = tuple(spec)
+                
+        # pack every [ID, address, length] entry with a single struct call
+        id_address_length_list = struct.pack("<" + "BHH" * len(spans),
+                *[item for id, (address, length) in spans.items() for item in (id, address, length)])
+        return (spans, id_address_length_list)
+        
+    def build_bulk_write(self, specs):
+        entries = []
+        for id, spec in specs.items():
+            values = dict([spec]) if isinstance(spec, tuple) else spec
+            control_table_class = type(self.servos[id].control_table)
+
+            # values written to one servo must form a single contiguous block
+            (address, length, fields) = control_table_class.get_block(values)
+            data = struct.pack("<" + control_table_class.get_block_format(fields),
+                    *[values[field["name"]] for field in fields])
+            entries.append(struct.pack("<BHH", id, address, length) + data)
+        return b"".join(entries)
+        
+    def store_values(self, field_name, values):
+        # mirror one field's new values into the local control tables
+        for id, value in values.items():
+            if id in self.servos:
+                self.servos[id].control_table.store_value(field_name, value)
+                
+    def store_bulk_values(self, specs):
+        for id, spec in specs.items():
+            values = dict([spec]) if isinstance(spec, tuple) else spec
+            self.servos[id].control_table.store_values(values)
+            
+    def prepare_write(self, servo_id, field_names):
+        # reusable write packet for a fixed servo and contiguous field block
+        control_table_class = type(self.servos[servo_id].control_table)
+        (address, length, fields) = control_table_class.get_block(field_names)
+        return RobotisDynamixel2PacketTemplate(servo_id,
+                RobotisDynamixel2Protocol.definitions_by_name["inst_write"][1],
+                struct.pack("<H", address), None,
+                control_table_class.get_block_format(fields),
+                servo_id != 0xFE)
+                
+    def prepare_sync_write(self, field_names, servo_ids):
+        # reusable sync_write packet for a fixed servo set and contiguous field block
+        control_table_class = type(self.servos[servo_ids[0]].control_table)
+        (address, length, fields) = control_table_class.get_block(field_names)
+        return RobotisDynamixel2PacketTemplate(0xFE,
+                RobotisDynamixel2Protocol.definitions_by_name["inst_sync_write"][1],
+                struct.pack("<HH", address, length), servo_ids,
+                control_table_class.get_block_format(fields),
+                False)
+                
+    def send_template(self, template, values):
+        # values are in field order, repeated per servo for sync_write; they
+        # are not mirrored into the local control tables
+        with self.bus_lock:
+            buffer = template.update(values)
+            
+            # let the parser match the status reply to this instruction
+            self.stream.parser_generator.register_instruction(template.id, template.instruction, template.response_required)
+            self.stream.write(buffer)
+            return buffer
+        
+    def collect_status_packets(self, _packet_name, spans, timeout=None):
+        # spans maps servo ID -> (address, length) of the data expected from it
+        responses = dict.fromkeys(spans)
+        remaining = len(spans)
+        while remaining > 0:
+            packet = self.wait_packet(_packet_name, _timeout=timeout)
+            if packet is None:
+                # timed out, any servo still missing did not respond
+                break
+                
+            # ignore stray replies (e.g. late responders from an earlier transaction)
+            id = packet.id
+            if id not in responses or responses[id] is not None:
+                continue
+            responses[id] = packet
+            remaining -= 1
+            self.decode_status_packet(packet, spans[id])
+                
+        return responses
+        
+    def decode_status_packet(self, packet, span):
+        # decode data into local control table if the full range came back
+        (address, length) = span
+        data = packet.data
+        if packet.id in self.servos and len(data) == length:
+            self.servos[packet.id].store_read_data(data, address)
+        
+    def decode_status_packets(self, responses, spans):
+        # decode a { servo ID: packet or None } dict of individual replies
+        for id, packet in responses.items():
+            if packet is not None:
+                self.decode_status_packet(packet, spans[id])
+        return responses
+        
+    def decode_fast_status_packet(self, packet, spans):
+        # all servos answer in one combined status packet, so every servo that
+        # responded maps to that same packet
+        responses = dict.fromkeys(spans)
+        if packet is None:
+            return responses
+            
+        segments = RobotisDynamixel2Protocol.split_fast_status(packet.buffer,
+                { id: length for id, (address, length) in spans.items() })
+        for id, (error, data) in segments.items():
+            responses[id] = packet
+            if id in self.servos:
+                self.servos[id].store_read_data(data, spans[id][0])
+                
+        return responses
+        
+    def fast_read_supported(self, servo_ids):
+        return all([id in self.servos and self.servos[id].fast_read_supported for id in servo_ids])
         
-        # wait for ping status replies until we time out
-        while self.wait_packet("stat_ping") is not None: pass
+    def fast_read_succeeded(self, packet, responses):
+        if any([response is not None for response in responses.values()]):
+            for id, response in responses.items():
+                if response is not None and id in self.servos:
+                    self.servos[id].fast_read_failures = 0
+            return True
+            
+        if packet is not None and len(packet.buffer) == 11 \
+                and packet.buffer[8] & 0x7F == self.instruction_error:
+            # explicit instruction error: the firmware does not know fast reads,
+            # so use classic reads from now on
+            for id in [packet.id] if packet.id in responses else responses:
+                if id in self.servos:
+                    self.servos[id].fast_read_supported = False
+            return False
+            
+        # lost or corrupted reply, only give up after repeated failures
+        for id in responses:
+            if id in self.servos:
+                servo = self.servos[id]
+                servo.fast_read_failures += 1
+                if servo.fast_read_failures >= self.fast_read_max_failures:
+                    servo.fast_read_supported = False
+        return False
         
-        # mark as scanned and return servo count
-        self.is_scanned = True
-        return len(self.servos)
+    def reset_fast_read(self, servo_ids=None):
+        # retry fast reads on servos that were switched to classic reads
+        for id in servo_ids if servo_ids is not None else self.servos:
+            if id in self.servos:
+                self.servos[id].reset_fast_read()
@@ -0,0 +1,137 @@
+import time
+
+class RobotisDynamixel2Framer():
+
+    header = b"\xFF\xFF\xFD\x00"
+    
+    # largest length field accepted as real; anything bigger is treated as a
+    # corrupted header instead of waiting for up to 64 KB of data
+    max_length = 2048
+    
+    def __init__(self, timeout=None):
+        # a partial frame older than this is dropped and rescanned
+        self.timeout = timeout
+        self.discarded_count = 0
+        self.reset()
+        
+    def reset(self):
+        # current chunk (any bytes-like object with find()) and scan position
+        self.data = b""
+        self.view = memoryview(self.data)
+        self.position = 0
+        
+        # frame split across chunks, filled in place as more data arrives
+        self.pending = None
+        self.pending_time = None
+        
+        # carried-over frame completed by the latest chunk, not yet emitted
+        self.ready = None
+        
+        # start of the last emitted frame within data (None if carried over)
+        self.last_start = None
+        self.last_frame = None
+        
+    def feed(self, chunk):
+        if not isinstance(chunk, (bytes, bytearray)):
+            chunk = bytes(chunk)
+        position = 0
+        
+        # a carried-over frame that never completed (e.g. a corrupted length
+        # that still looked sane) is dropped, and scanning resumes after its start
+        if self.pending is not None and self.timeout is not None \
+                and time.monotonic() - self.pending_time > self.timeout:
+            chunk = bytes(self.pending[1:]) + chunk
+            self.pending = None
+            self.discarded_count += 1
+            
+        # top up a frame carried over from earlier chunks before scanning
+        if self.pending is not None:
+            pending = self.pending
+            if len(pending) < 7:
+                position = min(7 - len(pending), len(chunk))
+                pending += chunk[:position]
+                if not self.header.startswith(bytes(pending[:4])) \
+                        or (len(pending) == 7 and not 3 <= pending[5] | (pending[6] << 8) <= self.max_length):
+                    # not a real header after all, rescan everything after it
+                    self.pending = None
+                    self.discarded_count += 1
+                    chunk = bytes(pending[1:]) + chunk[position:]
+                    position = 0
+            if self.pending is not None and len(pending) >= 7:
+                total = 7 + (pending[5] | (pending[6] << 8))
+                take = min(total - len(pending), len(chunk) - position)
+                pending += chunk[position:position + take]
+                position += take
+                if len(pending) == total:
+                    self.ready = pending
+                    self.pending = None
+                    
+        self.data = chunk
+        self.view = memoryview(chunk)
+        self.position = position
+        
+    def next_frame(self):
+        # emit a carried-over frame first, it precedes everything in data
+        if self.ready is not None:
+            self.last_frame = memoryview(self.ready)
+            self.last_start = None
+            self.ready = None
+            return self.last_frame
+            
+        data = self.data
+        while True:
+            start = data.find(self.header, self.position)
+            if start == -1:
+                # keep a possible partial header at the very end
+                keep = 0
+                for count in (3, 2, 1):
+                    if len(data) - count >= self.position and self.header.startswith(data[len(data) - count:]):
+                        keep = count
+                        break
+                self.discarded_count += len(data) - keep - self.position
+                if keep > 0:
+                    self.carry(data[len(data) - keep:])
+                self.position = len(data)
+                return None
+                
+            self.discarded_count += start - self.position
+            if start + 7 > len(data):
+                # header split across chunks, length not known yet
+                self.carry(data[start:])
+                self.position = len(data)
+                return None
+                
+            # read the length field once per frame
+            length = data[start + 5] | (data[start + 6] << 8)
+            if length < 3 or length > self.max_length:
+                # too short to hold instruction and CRC, or implausibly long,
+                # so skip this header
+                self.discarded_count += 1
+                self.position = start + 1
+                continue
+                
+            end = start + 7 + length
+            if end > len(data):
+                # frame split across chunks, carry it over
+                self.carry(data[start:])
+                self.position = len(data)
+                return None
+                
+            self.position = end
+            self.last_start = start
+            self.last_frame = self.view[start:end]
+            return self.last_frame
+            
+    def carry(self, data):
+        self.pending = bytearray(data)
+        self.pending_time = time.monotonic()
+        
+    def reject(self):
+        # the last frame was corrupt, resume scanning one byte past its start
+        if self.last_start is not None:
+            self.position = self.last_start + 1
+        else:
+            self.data = bytes(self.last_frame[1:]) + bytes(self.view[self.position:])
+            self.view = memoryview(self.data)
+            self.position = 0
+        self.discarded_count += 1
@@ -0,0 +1,79 @@
+import struct
+import perilib
+
+class RobotisDynamixel2IndirectMap():
+
+    def __init__(self, control_table_class, field_names, slot=1):
+        # each indirect address register points one byte of indirect data at
+        # any control table byte, so scattered fields can be read as one span
+        if control_table_class.get_field_info("indirect_address_%d" % slot) is None:
+            raise perilib.PerilibProtocolException(
+                    "%s has no indirect address slot %d" % (control_table_class.__name__, slot))
+        self.control_table_class = control_table_class
+        self.slot = slot
+
+        # field name -> (offset into indirect data, size), in the given order
+        self.entries = {}
+        self.sources = []
+        for field_name in field_names:
+            field = control_table_class.get_field_info(field_name)
+            if field is None:
+                raise perilib.PerilibProtocolException(
+                        "Unable to locate control table field '%s'" % field_name)
+            size = control_table_class.get_field_size(field)
+            self.entries[field_name] = (len(self.sources), size)
+            self.sources.extend(range(field["address"], field["address"] + size))
+
+        last_slot = slot + len(self.sources) - 1
+        if control_table_class.get_field_info("indirect_address_%d" % last_slot) is None:
+            raise perilib.PerilibProtocolException(
+                    "%d bytes do not fit in the indirect slots of %s starting at slot %d"
+                    % (len(self.sources), control_table_class.__name__, slot))
+        self.address_address = control_table_class.get_field_info("indirect_address_%d" % slot)["address"]
+        self.address = control_table_class.get_field_info("indirect_data_%d" % slot)["address"]
+        self.length = len(self.sources)
+
+    def covers(self, field_names):
+        return all([field_name in self.entries for field_name in field_names])
+
+    def get_span(self, field_names=None):
+        # (address, length) of the indirect data holding the given fields
+        if field_names is None:
+            return (self.address, self.length)
+        start = min([self.entries[field_name][0] for field_name in field_names])
+        end = max([sum(self.entries[field_name]) for field_name in field_names])
+        return (self.address + start, end - start)
+
+    def get_address_data(self):
+        # raw indirect address register values, one source address per byte
+        return struct.pack("<%dH" % self.length, *self.sources)
+
+    def program(self, servo):
+        # point this servo's indirect data at the mapped fields (X-series
+        # firmware only accepts this while torque is off)
+        with servo.device.bus_lock:
+            data = self.get_address_data()
+            packet = servo.device.stream.parser_generator.send_and_wait("inst_write", id=servo.id, address=self.address_address, data=data)
+            if packet is not None and packet is not False and packet.error == 0:
+                servo.control_table.populate_data_from_buffer(data, self.address_address)
+                servo.indirect_map = self
+            return packet
+
+    def program_all(self, device, servo_ids):
+        # same as program(), but for several servos with one sync_write
+        with device.bus_lock:
+            data = self.get_address_data()
+            packet = device.broadcast_packet("inst_sync_write", address=self.address_address, length=len(data),
+                    id_data_list=b"".join([bytes([id]) + data for id in servo_ids]))
+            for id in servo_ids:
+                device.servos[id].control_table.populate_data_from_buffer(data, self.address_address)
+                device.servos[id].indirect_map = self
+            return packet
+
+    def decode(self, control_table, data, address):
+        # copy mapped bytes found in a read of indirect data back into the
+        # normal named fields
+        for field_name, (offset, size) in self.entries.items():
+            start = self.address + offset - address
+            if start >= 0 and start + size <= len(data):
+                control_table.populate_data_from_buffer(data[start:start + size], self.sources[offset])
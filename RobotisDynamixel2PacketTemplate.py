@@ -0,0 +1,66 @@
+import struct
+
+from .RobotisDynamixel2Crc import *
+from .RobotisDynamixel2Stuffing import *
+
+class RobotisDynamixel2PacketTemplate():
+
+    def __init__(self, id, instruction, fixed_parameters, slot_ids, value_format, response_required=False):
+        # parameters are fixed_parameters followed by either one value block
+        # (slot_ids is None, e.g. write) or one [ID, value block] slot per
+        # servo ID (e.g. sync_write)
+        self.id = id
+        self.instruction = instruction
+        self.slot_ids = slot_ids
+        self.response_required = response_required
+        self.values_per_slot = len(struct.Struct("<" + value_format).unpack(bytes(struct.calcsize("<" + value_format))))
+        
+        # preset argument list, only value positions change between cycles
+        if slot_ids is None:
+            self.codec = struct.Struct("<" + value_format)
+            self.arguments = [0] * self.values_per_slot
+        else:
+            self.codec = struct.Struct("<" + ("B" + value_format) * len(slot_ids))
+            self.arguments = []
+            for slot_id in slot_ids:
+                self.arguments += [slot_id] + [0] * self.values_per_slot
+                
+        # preallocated packet: header, fixed parameters, values, CRC
+        self.values_offset = 8 + len(fixed_parameters)
+        self.buffer = bytearray(self.values_offset + self.codec.size + 2)
+        self.view = memoryview(self.buffer)
+        struct.pack_into("<5BHB", self.buffer, 0,
+                0xFF, 0xFF, 0xFD, 0x00, id, len(self.buffer) - 7, instruction)
+        self.buffer[8:self.values_offset] = fixed_parameters
+        
+        # CRC state over everything before the first changing byte, and a
+        # fixed view of the changing bytes for the per-cycle CRC update
+        self.prefix_crc = RobotisDynamixel2Crc.update(0, self.view[:self.values_offset])
+        self.crc_offset = len(self.buffer) - 2
+        self.values_view = self.view[self.values_offset:self.crc_offset]
+        
+    def update(self, values):
+        # patch new values in place, then the CRC
+        arguments = self.arguments
+        if self.slot_ids is None:
+            arguments[:] = values
+        elif self.values_per_slot == 1:
+            arguments[1::2] = values
+        else:
+            stride = self.values_per_slot + 1
+            for slot in range(len(self.slot_ids)):
+                arguments[slot * stride + 1:(slot + 1) * stride] = values[slot * self.values_per_slot:(slot + 1) * self.values_per_slot]
+        self.codec.pack_into(self.buffer, self.values_offset, *arguments)
+        
+        # rare case: new values contain FF FF FD, which changes the packet
+        # length, so return a stuffed copy instead of the template buffer
+        if self.buffer.find(RobotisDynamixel2Stuffing.pattern, 8, self.crc_offset) != -1:
+            return self.build_stuffed()
+            
+        struct.pack_into("<H", self.buffer, self.crc_offset, RobotisDynamixel2Crc.update(self.prefix_crc, self.values_view))
+        return self.buffer
+        
+    def build_stuffed(self):
+        parameters = RobotisDynamixel2Stuffing.stuff(self.buffer[8:-2])
+        buffer = struct.pack("<5BHB", 0xFF, 0xFF, 0xFD, 0x00, self.id, len(parameters) + 3, self.instruction) + bytes(parameters)
+        return buffer + struct.pack("<H", RobotisDynamixel2Crc.update(0, buffer))
@@ -1,15 +1,81 @@
 import struct
+import time
 import perilib
 
 from .RobotisDynamixel2Protocol import *
+from .RobotisDynamixel2Framer import *
 
 class RobotisDynamixel2ParserGenerator(perilib.StreamParserGenerator):
 
     def __init__(self, protocol_class=RobotisDynamixel2Protocol, stream=None):
         super().__init__(protocol_class, stream)
         self.last_instruction = None
+        
+        # outstanding instructions per servo ID, as (instruction, deadline)
+        self.pending_instructions = {}
+        self.pending_broadcast = None
+        
+        self.crc_error_count = 0
+        self.crc_error_counts = {}
+        self.framer = RobotisDynamixel2Framer(protocol_class.incoming_packet_timeout)
 
-    def _on_tx_packet(self, packet):
+    def parse(self, input_data):
+        # allow single byte or iterable input, same as the base parser
+        if isinstance(input_data, int):
+            input_data = [input_data]
+            
+        # split whole chunks into frames instead of testing every byte
+        self.framer.feed(input_data)
+        frame = self.framer.next_frame()
+        while frame is not None:
+            try:
+                packet = self.protocol_class.get_packet_from_buffer(frame, self)
+            except RobotisDynamixel2CrcException as e:
+                # resync from the next header candidate inside the bad frame
+                self.framer.reject()
+                if self.on_rx_error is not None:
+                    self.on_rx_error(e, bytes(frame), self)
+            except perilib.PerilibProtocolException as e:
+                if self.on_rx_error is not None:
+                    self.on_rx_error(e, bytes(frame), self)
+            else:
+                self._on_rx_packet(packet)
+            frame = self.framer.next_frame()
+                
+    def record_crc_error(self, id, buffer):
+        # per-servo and total failure counters (ID may itself be corrupted)
+        self.crc_error_count += 1
+        self.crc_error_counts[id] = self.crc_error_counts.get(id, 0) + 1
+
+    def instruction_for_status(self, id):
+        # match a status packet to the latest unexpired instruction sent to
+        # that servo, then to a broadcast that servo may be answering
+        now = time.monotonic()
+        pending = self.pending_instructions.get(id)
+        if pending is not None and pending[1] >= now:
+            return pending[0]
+        if self.pending_broadcast is not None and self.pending_broadcast[1] >= now:
+            return self.pending_broadcast[0]
+        return self.last_instruction
+
+    def register_instruction(self, id, instruction, response_required):
         # store instruction byte for reference
-        self.last_instruction = packet.buffer[7]
+        self.last_instruction = instruction
+        
+        # remember who should answer, so replies are correlated per servo; a
+        # newer instruction replaces any older one to the same servo, since a
+        # servo only ever answers the instruction it received last (and may
+        # not have answered the previous one at all)
+        if response_required:
+            deadline = time.monotonic() + self.protocol_class.response_packet_timeout
+            if id == 0xFE:
+                self.pending_broadcast = (instruction, deadline)
+                self.pending_instructions.clear()
+            else:
+                self.pending_instructions[id] = (instruction, deadline)
+        else:
+            self.pending_instructions.pop(id, None)
+
+    def _on_tx_packet(self, packet):
+        self.register_instruction(packet.buffer[4], packet.buffer[7], "response_required" in packet.definition)
         super()._on_tx_packet(packet)
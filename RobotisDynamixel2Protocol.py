@@ -1,8 +1,12 @@
 import struct
+import types
 import perilib
 
 from .RobotisDynamixel2Packet import *
 
+class RobotisDynamixel2CrcException(perilib.PerilibProtocolException):
+    pass
+
 class RobotisDynamixel2Protocol(perilib.StreamProtocol):
 
     # http://emanual.robotis.com/docs/en/dxl/protocol2/
@@ -24,6 +28,10 @@ class RobotisDynamixel2Protocol(perilib.StreamProtocol):
     incoming_packet_timeout = 0.25
     response_packet_timeout = 0.25
     
+    # read-only lookup tables, built from instructions by build_definition_index
+    definitions_by_name = {}
+    definitions_by_opcode = {}
+    
     instructions = {
         0x01: { # id = 0x01 (ping)
             "name": "ping",
@@ -119,6 +127,18 @@ class RobotisDynamixel2Protocol(perilib.StreamProtocol):
             ],
             "incoming_args": [],
         },
+        0x8A: { # id = 0x8A (fast_sync_read)
+            "name": "fast_sync_read",
+            "outgoing_args": [
+                { "name": "address", "type": "uint16" },
+                { "name": "length", "type": "uint16" },
+                { "name": "id_list", "type": "uint8a-greedy" }
+            ],
+            "incoming_args": [
+                # [error, id, data..., crc] per servo, last crc is the footer
+                { "name": "data", "type": "uint8a-greedy" }
+            ],
+        },
         0x92: { # id = 0x92 (bulk_read)
             "name": "bulk_read",
             "outgoing_args": [
@@ -130,12 +150,22 @@ class RobotisDynamixel2Protocol(perilib.StreamProtocol):
             ],
         },
         0x93: { # id = 0x93 (bulk_write)
-            "name": "sync_write",
+            "name": "bulk_write",
             "outgoing_args": [
                 { "name": "id_address_length_data_list", "type": "uint8a-greedy" }
             ],
             "incoming_args": [],
         },
+        0x9A: { # id = 0x9A (fast_bulk_read)
+            "name": "fast_bulk_read",
+            "outgoing_args": [
+                { "name": "id_address_length_list", "type": "uint8a-greedy" }
+            ],
+            "incoming_args": [
+                # [error, id, data..., crc] per servo, last crc is the footer
+                { "name": "data", "type": "uint8a-greedy" }
+            ],
+        },
     }
 
     @classmethod
@@ -152,7 +182,6 @@ class RobotisDynamixel2Protocol(perilib.StreamProtocol):
             # check 11-bit "length" field in 4-byte header
             (packet_length,) = struct.unpack("<H", buffer[5:7])
             if len(buffer) == packet_length + 7:
-                (crc,) = struct.unpack("<H", buffer[-2:])
                 return perilib.ParseStatus.COMPLETE
 
         # not finished if we made it here
@@ -163,101 +192,127 @@ class RobotisDynamixel2Protocol(perilib.StreamProtocol):
         (id, length, instruction) = struct.unpack("<BHB", buffer[4:8])
         (crc,) = struct.unpack("<H", buffer[-2:])
         
-        # remove byte stuffing from instruction/payload, if present
-        unstuffed_buffer = []
-        unstuffing_needed = False
-        seen = []
-        for b in buffer[8:-2]:
-            unstuff_this_byte = False
-            if b == 0xFF and len(seen) == 0:
-                seen.append(b)
-            elif b == 0xFF and len(seen) == 1:
-                seen.append(b)
-            elif b == 0xFD and len(seen) == 2:
-                # stuff an extra 0xFD byte and reset status
-                unstuffing_needed = True
-                unstuff_this_byte = True
-                seen = []
-            else:
-                # pattern broken, reset
-                seen = []
-                
-            if not unstuff_this_byte:
-                unstuffed_buffer.append(b)
-                
-        # add the CRC field at the end (not checked for stuffing)
-        for b in buffer[-2:]:
-            unstuffed_buffer.append(b)
-                
-        # replace original buffer with unstuffed one
-        if unstuffing_needed:
-            buffer = bytes(unstuffed_buffer)
+        # verify CRC over the frame as received (still byte-stuffed)
+        if RobotisDynamixel2Crc.update(0, memoryview(buffer)[:-2]) != crc:
+            if parser_generator is not None:
+                parser_generator.record_crc_error(id, buffer)
+            raise RobotisDynamixel2CrcException(
+                    "CRC mismatch in packet from ID %d (received 0x%04X)" % (id, crc))
+        
+        # remove byte stuffing from instruction/payload, if present (the CRC
+        # field at the end is not checked for stuffing)
+        payload = buffer[8:-2]
+        unstuffed_payload = RobotisDynamixel2Stuffing.unstuff(payload)
+        if len(unstuffed_payload) != len(payload):
+            buffer = bytes(buffer[:8]) + bytes(unstuffed_payload) + bytes(buffer[-2:])
         
-        try:
-            if instruction == 0x55:
-                if "last_instruction" in parser_generator.__dict__:
-                    packet_type = RobotisDynamixel2Packet.TYPE_STATUS
-                    packet_definition = RobotisDynamixel2Protocol.instructions[parser_generator.last_instruction]
-                    packet_name = "stat_%s" % packet_definition["name"]
-                else:
-                    raise perilib.PerilibProtocolException(
-                            "No known previous instruction, cannot match status packet with correct definition")
+        if instruction == 0x55:
+            # status packet, matched to the instruction that triggered it
+            if parser_generator is not None and hasattr(parser_generator, "instruction_for_status"):
+                status_instruction = parser_generator.instruction_for_status(id)
             else:
-                packet_type = RobotisDynamixel2Packet.TYPE_INSTRUCTION
-                packet_definition = RobotisDynamixel2Protocol.instructions[instruction]
-                if len(packet_definition["incoming_args"]) > 0:
-                    packet_definition["response_required"] = "stat_%s" % packet_definition["name"]
-                packet_name = "inst_%s" % packet_definition["name"]
+                status_instruction = getattr(parser_generator, "last_instruction", None)
+            if status_instruction is None:
+                raise perilib.PerilibProtocolException(
+                        "No known previous instruction, cannot match status packet with correct definition")
+            entry = cls.definitions_by_opcode.get(status_instruction)
+            if entry is None:
+                raise perilib.PerilibProtocolException(
+                        "Could not find packet definition for instruction 0x%02X" % status_instruction)
+            (packet_type, packet_name, packet_definition) = entry[RobotisDynamixel2Packet.TYPE_STATUS]
+            
+            # status packets are the receive hot path, decode them lazily
+            return RobotisDynamixel2StatusPacket(name=packet_name, definition=packet_definition, buffer=buffer, parser_generator=parser_generator)
+        else:
+            entry = cls.definitions_by_opcode.get(instruction)
+            if entry is None:
+                raise perilib.PerilibProtocolException(
+                        "Could not find packet definition for instruction 0x%02X" % instruction)
+            (packet_type, packet_name, packet_definition) = entry[RobotisDynamixel2Packet.TYPE_INSTRUCTION]
+            if parser_generator is not None:
                 parser_generator.last_instruction = instruction
-        except KeyError as e:
-            raise perilib.PerilibProtocolException(
-                    "Could not find packet definition for instruction 0x%02X"
-                    % (parser_generator.last_instruction))
 
-        packet_definition["header_args"] = RobotisDynamixel2Protocol.header_args
-        packet_definition["footer_args"] = RobotisDynamixel2Protocol.footer_args
         packet_metadata = {
             "id": id,
             "instruction": instruction,
             "crc": crc
         }
 
+        # frames may arrive as memoryview slices of a larger chunk
+        buffer = bytes(buffer)
         return RobotisDynamixel2Packet(type=packet_type, name=packet_name, definition=packet_definition, buffer=buffer, metadata=packet_metadata, parser_generator=parser_generator)
 
     @classmethod
     def get_packet_from_name_and_args(cls, _packet_name, _parser_generator=None, **kwargs):
         # prepend instruction slug if no slug present
-        if len(_packet_name) < 6 or _packet_name[0:5] not in ["inst_", "stat_"]:
+        entry = cls.definitions_by_name.get(_packet_name)
+        if entry is None:
             _packet_name = "inst_" + _packet_name
-            
-        # split "ble_cmd_system_hello" into relevant parts
-        parts = _packet_name.split('_', maxsplit=1)
-        instruction_name = parts[1]
-        if parts[0] == "inst":
-            # outgoing instruction
-            packet_type = RobotisDynamixel2Packet.TYPE_INSTRUCTION
-        elif parts[0] == "stat":
-            # incoming status packet
-            packet_type = RobotisDynamixel2Packet.TYPE_STATUS
+            entry = cls.definitions_by_name.get(_packet_name)
+            if entry is None:
+                # unable to find correct packet
+                raise perilib.PerilibProtocolException("Unable to locate packet definition for '%s'" % _packet_name)
+
+        (packet_type, instruction, packet_definition) = entry
+        packet_metadata = {
+            "id": kwargs["id"],
+            "instruction": instruction,
+            "crc": None
+        }
+        
+        return RobotisDynamixel2Packet(type=packet_type, name=_packet_name, definition=packet_definition, payload=kwargs, metadata=packet_metadata, parser_generator=_parser_generator)
 
-        # find the entry in the protocol definition table
-        for instruction in RobotisDynamixel2Protocol.instructions:
-            if type(instruction) == str:
-                continue
-            if RobotisDynamixel2Protocol.instructions[instruction]["name"] == instruction_name:
-                packet_definition = RobotisDynamixel2Protocol.instructions[instruction]
-                packet_definition["header_args"] = RobotisDynamixel2Protocol.header_args
-                packet_definition["footer_args"] = RobotisDynamixel2Protocol.footer_args
-                if len(packet_definition["incoming_args"]) > 0:
-                    packet_definition["response_required"] = "stat_%s" % packet_definition["name"]
+    @classmethod
+    def build_definition_index(cls):
+        # freeze every instruction into read-only instruction and status
+        # definitions (with header/footer attached) and index them by name and
+        # opcode, so building or parsing a packet needs no searches or writes
+        freeze_args = lambda args: tuple([types.MappingProxyType(dict(arg)) for arg in args])
+        header_args = freeze_args(cls.header_args)
+        footer_args = freeze_args(cls.footer_args)
+        cls.definitions_by_name = {}
+        cls.definitions_by_opcode = {}
+        for instruction, definition in cls.instructions.items():
+            frozen = {}
+            for packet_type in (RobotisDynamixel2Packet.TYPE_INSTRUCTION, RobotisDynamixel2Packet.TYPE_STATUS):
+                packet_definition = dict(definition)
+                packet_definition["outgoing_args"] = freeze_args(definition["outgoing_args"])
+                packet_definition["incoming_args"] = freeze_args(definition["incoming_args"])
+                packet_definition["header_args"] = header_args
+                packet_definition["footer_args"] = footer_args
+                packet_name = "%s_%s" % (("inst", "stat")[packet_type], definition["name"])
+                if packet_type == RobotisDynamixel2Packet.TYPE_INSTRUCTION and len(definition["incoming_args"]) > 0:
+                    packet_definition["response_required"] = "stat_%s" % definition["name"]
+                packet_definition = types.MappingProxyType(packet_definition)
+                cls.definitions_by_name[packet_name] = (packet_type, instruction, packet_definition)
+                frozen[packet_type] = (packet_type, packet_name, packet_definition)
+            cls.definitions_by_opcode[instruction] = frozen
 
-                packet_metadata = {
-                    "id": kwargs["id"],
-                    "instruction": instruction,
-                    "crc": None
-                }
-                
-                return RobotisDynamixel2Packet(type=packet_type, name=_packet_name, definition=packet_definition, payload=kwargs, metadata=packet_metadata, parser_generator=_parser_generator)
+    @classmethod
+    def split_fast_status(cls, buffer, lengths):
+        # slice a combined fast_sync_read/fast_bulk_read status frame into
+        # per-servo segments; lengths maps servo ID -> expected data length
+        segments = {}
+        
+        # each servo appends its CRC over the entire frame so far, but that only
+        # matches the received bytes if no byte stuffing had to be removed
+        check_crc = buffer.find(b"\xFF\xFF\xFD", 8, len(buffer) - 2) == -1
+        crc = RobotisDynamixel2Packet.update_crc(0, buffer[:8])
+        
+        position = 8
+        while position + 4 <= len(buffer):
+            (error, id) = struct.unpack("<BB", buffer[position:position + 2])
+            if id not in lengths or position + lengths[id] + 4 > len(buffer):
+                # unknown servo or truncated segment, cannot find further boundaries
+                break
+            data_end = position + 2 + lengths[id]
+            crc = RobotisDynamixel2Packet.update_crc(crc, buffer[position:data_end])
+            (segment_crc,) = struct.unpack("<H", buffer[data_end:data_end + 2])
+            if not check_crc or segment_crc == crc:
+                segments[id] = (error, buffer[position + 2:data_end])
+            crc = RobotisDynamixel2Packet.update_crc(crc, buffer[data_end:data_end + 2])
+            position = data_end + 2
+            
+        return segments
 
-        # unable to find correct packet
-        raise perilib.PerilibProtocolException("Unable to locate packet definition for '%s'" % _packet_name)
+RobotisDynamixel2Protocol.build_definition_index()
@@ -1,5 +1,3 @@
-import perilib
-
 from .RobotisDynamixel2ControlTable import *
 
 class RobotisDynamixel2Servo():
@@ -56,12 +54,24 @@ class RobotisDynamixel2Servo():
         2020:   { "name": "PRO-H54P-200-S500-R" },
     }
     
+    # X-series firmware that understands fast_sync_read/fast_bulk_read
+    fast_read_min_firmware_version = 45
+    
+    # rewriting up to this many clean bytes between two dirty fields costs
+    # less than another write round trip (12 byte instruction overhead plus
+    # an 11 byte status reply)
+    write_merge_gap = 23
+    
     def __init__(self, id=None, model_number=None, firmware_version=None, device=None):
         self.id = id
         self.model_number = model_number
         self.firmware_version = firmware_version
         self.device = device
         self.control_table = RobotisDynamixel2Servo.models[self.model_number]["control_table_class"]()
+        self.reset_fast_read()
+        
+        # RobotisDynamixel2IndirectMap programmed into this servo, if any
+        self.indirect_map = None
         
     def __str__(self):
         id_str = ("#%d" % self.id) if self.id is not None else "unidentified servo"
@@ -70,24 +80,117 @@ class RobotisDynamixel2Servo():
         device_str = str(self.device) if self.device is not None else "unidentified device"
         return "%s (%s @ v%s) on %s" % (id_str, model_number_str, firmware_version_str, device_str)
 
+    def reset_fast_read(self):
+        # assume fast reads work again if the model and firmware allow them
+        self.fast_read_supported = self.control_table.__class__ == ControlTableX \
+                and self.firmware_version is not None \
+                and self.firmware_version >= RobotisDynamixel2Servo.fast_read_min_firmware_version
+        self.fast_read_failures = 0
+        
+    def replies_to_writes(self):
+        # status_return_level 2 (the default, assumed while unknown) answers
+        # every instruction; 0 and 1 answer only ping and reads
+        if self.control_table.get_field_info("status_return_level") is None:
+            return True
+        level = self.control_table["status_return_level"]
+        return level is None or level >= 2
+        
     def ping(self):
-        return self.device.stream.parser_generator.send_and_wait("inst_ping", id=self.id)
+        with self.device.bus_lock:
+            return self.device.stream.parser_generator.send_and_wait("inst_ping", id=self.id)
 
-    def read_control_table(self):
-        packet = self.device.stream.parser_generator.send_and_wait("inst_read", id=self.id, address=0, length=self.control_table.size)
-        if packet is not None and packet is not False:
-            self.control_table.populate_data_from_buffer(packet.payload["data"])
-        return packet
+    def read_control_table(self, region=None):
+        # standard area by default (plus the indirect block when an indirect
+        # map uses it), or only the "eeprom" or "ram" area
+        with self.device.bus_lock:
+            if region is None:
+                (address, length) = self.get_full_span()
+            else:
+                (address, length) = self.control_table.get_region_span(region)
+            packet = self.device.stream.parser_generator.send_and_wait("inst_read", id=self.id, address=address, length=length)
+            if packet is not None and packet is not False:
+                self.store_read_data(packet.data, address)
+            return packet
+        
+    def read_fields(self, field_names):
+        # read only the requested fields, using one read per span; nearby
+        # fields share a read when that is cheaper than another transaction
+        with self.device.bus_lock:
+            packets = []
+            for (address, length) in self.get_read_spans(field_names):
+                packet = self.device.stream.parser_generator.send_and_wait("inst_read", id=self.id, address=address, length=length)
+                if packet is not None and packet is not False:
+                    self.store_read_data(packet.data, address)
+                packets.append(packet)
+            return packets
+        
+    def get_full_span(self):
+        if self.indirect_map is not None:
+            return (0, self.control_table.size)
+        return self.control_table.get_standard_span()
+        
+    def get_read_spans(self, field_names):
+        # fields mirrored by the indirect map come back in one short span
+        if self.indirect_map is not None and self.indirect_map.covers(field_names):
+            return [self.indirect_map.get_span(field_names)]
+        return self.control_table.get_spans(field_names, self.device.get_read_merge_gap())
+        
+    def store_read_data(self, data, address):
+        self.control_table.populate_data_from_buffer(data, address)
+        if self.indirect_map is not None:
+            self.indirect_map.decode(self.control_table, data, address)
+        
+    def refresh(self, region="ram"):
+        # re-read every field in the "eeprom" or "ram" area
+        return self.read_fields(self.control_table.get_region_fields(region))
         
     def update_value(self, field_name, value, broadcast=False):
+        with self.device.bus_lock:
+            field = self.control_table.get_field_info(field_name)
+            data = self.control_table.pack_value(field_name, value)
+            use_id = self.id if not broadcast else 0xFE
+            packet = self.device.stream.parser_generator.send_and_wait("inst_write", id=use_id, address=field["address"], data=data)
+            
+            # update local control table data with new value if successful
+            if packet is not None and packet is not False and packet.error == 0:
+                self.control_table.store_value(field_name, value)
+                
+            return packet
+        
+    def flush(self):
+        # write-back mode: send all staged changes in as few writes as possible
+        with self.device.bus_lock:
+            packets = []
+            for (address, length) in self.control_table.get_dirty_spans(self.write_merge_gap):
+                packet = self.device.stream.parser_generator.send_and_wait("inst_write", id=self.id, address=address,
+                        data=self.control_table.get_data(address, length))
+                
+                # keep failed spans dirty so the next flush() retries them
+                if packet is not None and packet is not False and packet.error == 0:
+                    self.control_table.clear_dirty(address, length)
+                packets.append(packet)
+            return packets
+        
+    async def ping_async(self):
+        # same as ping(), but awaits the reply on an asyncio device
+        return await self.device.transact("inst_ping", id=self.id)
+        
+    async def read_control_table_async(self):
+        (address, length) = self.get_full_span()
+        packet = await self.device.transact("inst_read", id=self.id, address=address, length=length)
+        if packet is not None:
+            self.store_read_data(packet.data, address)
+        return packet
+        
+    async def update_value_async(self, field_name, value, broadcast=False):
         field = self.control_table.get_field_info(field_name)
-        data = perilib.StreamProtocol.pack_values({field_name: value}, [field])
+        data = self.control_table.pack_value(field_name, value)
         use_id = self.id if not broadcast else 0xFE
-        packet = self.device.stream.parser_generator.send_and_wait("inst_write", id=use_id, address=field["address"], data=data)
+        packet = await self.device.transact("inst_write", id=use_id, address=field["address"], data=data)
         
-        # update local control table data with new value if successful
-        if packet is not None and packet is not False and packet.payload["error"] == 0:
-            self.control_table._data[field_name] = value
+        # update local control table data with new value if successful (a
+        # broadcast write has no reply, so the sent packet comes back instead)
+        if packet is not None and (broadcast or packet.error == 0):
+            self.control_table.store_value(field_name, value)
             
         return packet
-        
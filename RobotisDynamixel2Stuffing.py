@@ -0,0 +1,66 @@
+import re
+
+class RobotisDynamixel2Stuffing():
+
+    # any FF FF FD in the instruction/parameter field is sent as FF FF FD FD
+    pattern = b"\xFF\xFF\xFD"
+    stuffed_pattern = b"\xFF\xFF\xFD\xFD"
+    
+    # bytes.find() needs a bytes haystack, but the regex engine can search a
+    # memoryview (e.g. a frame sliced from a received chunk) without copying
+    stuffed_search = re.compile(re.escape(stuffed_pattern)).search
+    
+    @classmethod
+    def stuff(cls, data):
+        # most payloads never contain the pattern, return them untouched
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+        index = data.find(cls.pattern)
+        if index == -1:
+            return data
+            
+        # copy runs between occurrences into a buffer of exactly the final size
+        stuffed = bytearray(len(data) + data.count(cls.pattern))
+        source = 0
+        target = 0
+        while index != -1:
+            end = index + len(cls.pattern)
+            stuffed[target:target + end - source] = data[source:end]
+            target += end - source
+            stuffed[target] = 0xFD
+            target += 1
+            source = end
+            index = data.find(cls.pattern, source)
+        stuffed[target:] = data[source:]
+        return stuffed
+        
+    @classmethod
+    def unstuff(cls, data):
+        # most payloads never contain the pattern, return them untouched
+        if isinstance(data, memoryview):
+            match = cls.stuffed_search(data)
+            if match is None:
+                return data
+                
+            # only copy a view once there is something to remove
+            data = bytes(data)
+            index = match.start()
+        else:
+            if not isinstance(data, (bytes, bytearray)):
+                data = bytes(data)
+            index = data.find(cls.stuffed_pattern)
+            if index == -1:
+                return data
+            
+        # copy runs between occurrences, dropping each extra FD
+        unstuffed = bytearray(len(data) - data.count(cls.stuffed_pattern))
+        source = 0
+        target = 0
+        while index != -1:
+            end = index + len(cls.pattern)
+            unstuffed[target:target + end - source] = data[source:end]
+            target += end - source
+            source = end + 1
+            index = data.find(cls.stuffed_pattern, source)
+        unstuffed[target:] = data[source:]
+        return unstuffed
@@ -0,0 +1,118 @@
+import threading
+import time
+import perilib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class RobotisDynamixel2Telemetry():
+
+    def __init__(self, device, field_names, servo_ids=None, rate=100.0, capacity=1000, timeout=None):
+        if numpy is None:
+            raise perilib.PerilibProtocolException("numpy is required for telemetry ring buffers")
+        self.device = device
+        self.field_names = list(field_names)
+        self.servo_ids = list(servo_ids) if servo_ids is not None else sorted(device.servos)
+        self.period = 1.0 / rate
+        self.capacity = capacity
+        self.timeout = timeout
+
+        # mirrored ring buffers (servo x time x field): every sample is stored
+        # twice, capacity slots apart, so the latest `capacity` samples are
+        # always one contiguous slice and windows never need to be copied
+        self.data = numpy.full((len(self.servo_ids), 2 * capacity, len(self.field_names)), numpy.nan)
+        self.timestamps = numpy.full(2 * capacity, numpy.nan)
+        self.servo_indexes = { id: index for index, id in enumerate(self.servo_ids) }
+        self.field_indexes = { name: index for index, name in enumerate(self.field_names) }
+
+        # total samples written, ticks skipped because a read overran, and
+        # reads that failed outright
+        self.count = 0
+        self.overruns = 0
+        self.errors = 0
+
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="dynamixel-telemetry-%s" % self.device, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        # fixed-rate schedule; a late read skips the ticks it missed instead
+        # of firing a burst of catch-up reads
+        next_time = time.monotonic()
+        while not self.stop_event.is_set():
+            self.poll_once()
+            next_time += self.period
+            now = time.monotonic()
+            if now > next_time:
+                missed = int((now - next_time) / self.period) + 1
+                self.overruns += missed
+                next_time += missed * self.period
+            self.stop_event.wait(next_time - now if next_time > now else 0)
+
+    def poll_once(self):
+        # one group read of all selected fields, then store the decoded values
+        try:
+            responses = self.device.sync_read(self.field_names, self.servo_ids, self.timeout)
+        except perilib.PerilibProtocolException:
+            # keep polling; the failed tick is stored as missing (NaN)
+            self.errors += 1
+            responses = {}
+        self.record(time.monotonic(), responses)
+
+    def record(self, timestamp, responses):
+        slot = self.count % self.capacity
+        for id, index in self.servo_indexes.items():
+            if responses.get(id) is None:
+                values = numpy.nan
+            else:
+                control_table = self.device.servos[id].control_table
+                values = [control_table[field_name] for field_name in self.field_names]
+                values = [numpy.nan if value is None else value for value in values]
+            self.data[index, slot] = values
+            self.data[index, slot + self.capacity] = values
+        self.timestamps[slot] = timestamp
+        self.timestamps[slot + self.capacity] = timestamp
+
+        # publish the sample only once it is fully written
+        self.count += 1
+
+    def window(self, length=None):
+        # (timestamps, data) views of the latest samples, oldest first, with
+        # data shaped servo x time x field
+        available = min(self.count, self.capacity)
+        length = available if length is None else min(length, available)
+        end = (self.count - 1) % self.capacity + self.capacity + 1
+        return (self.timestamps[end - length:end], self.data[:, end - length:end])
+
+    def latest(self, field_name=None, servo_id=None):
+        # view of the newest sample: servo x field, or narrowed by field/servo
+        if self.count == 0:
+            return None
+        sample = self.data[:, (self.count - 1) % self.capacity + self.capacity]
+        if servo_id is not None:
+            sample = sample[self.servo_indexes[servo_id]]
+            return sample if field_name is None else sample[self.field_indexes[field_name]]
+        return sample if field_name is None else sample[:, self.field_indexes[field_name]]
+
+    def latest_timestamp(self):
+        if self.count == 0:
+            return None
+        return self.timestamps[(self.count - 1) % self.capacity + self.capacity]
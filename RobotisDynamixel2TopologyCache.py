@@ -0,0 +1,91 @@
+import json
+import os
+
+from .RobotisDynamixel2Device import *
+
+class RobotisDynamixel2TopologyCache():
+
+    def __init__(self, path):
+        self.path = path
+
+        # adapter key -> { "baudrate": ..., "servos": { "<id>": { ... } } }
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        # the cache is disposable, so a missing or unreadable file is empty
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        # write to a temporary file first so a crash never leaves half a cache
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    @classmethod
+    def get_port_key(cls, device):
+        # identify the adapter itself (VID:PID:serial) rather than the port
+        # name, which may change between runs or after re-plugging
+        port_info = getattr(device.stream, "port_info", None)
+        if port_info is not None and getattr(port_info, "vid", None) is not None:
+            return "%04X:%04X:%s" % (port_info.vid, port_info.pid,
+                    port_info.serial_number if port_info.serial_number else port_info.device)
+        if port_info is not None and getattr(port_info, "device", None) is not None:
+            return str(port_info.device)
+        return str(device.port if device.port is not None else device.id)
+
+    def store(self, device):
+        # record models, firmware versions and (fully read) EEPROM images
+        servos = {}
+        for id, servo in device.servos.items():
+            entry = { "model_number": servo.model_number, "firmware_version": servo.firmware_version }
+            (address, length) = servo.control_table.get_region_span("eeprom")
+            eeprom = servo.control_table.get_data(address, length)
+            if eeprom is not None:
+                entry["eeprom"] = eeprom.hex()
+            servos[str(id)] = entry
+        self.entries[self.get_port_key(device)] = { "baudrate": device.baudrate, "servos": servos }
+
+    def restore(self, device):
+        # confirm the cached topology with one broadcast ping that stops as
+        # soon as every known servo has answered, then load EEPROM images
+        entry = self.entries.get(self.get_port_key(device))
+        if entry is None or len(entry["servos"]) == 0:
+            return False
+        with device.bus_lock:
+            original_baudrate = device.baudrate
+            if entry["baudrate"] != device.baudrate:
+                device.set_baudrate(entry["baudrate"])
+            cached = { int(id): servo for id, servo in entry["servos"].items() }
+            ids = device.scan_window(max(cached), expected_ids=cached)
+            if ids != set(cached) or any([device.servos[id].model_number != servo["model_number"]
+                    or device.servos[id].firmware_version != servo["firmware_version"] for id, servo in cached.items()]):
+                # stale cache, put the bus back the way it was for a full scan
+                if device.baudrate != original_baudrate:
+                    device.set_baudrate(original_baudrate)
+                return False
+
+            for id, servo in cached.items():
+                if "eeprom" in servo:
+                    control_table = device.servos[id].control_table
+                    control_table.populate_data_from_buffer(bytes.fromhex(servo["eeprom"]),
+                            control_table.get_region_span("eeprom")[0])
+            device.is_scanned = True
+            return True
+
+    def scan(self, device):
+        # use the cache when it still matches, else do a full scan, read the
+        # EEPROM of every servo and refresh the cache
+        if self.restore(device):
+            return len(device.servos)
+        device.scan()
+        for id, servo in device.servos.items():
+            servo.read_control_table("eeprom")
+        self.store(device)
+        self.save()
+        return len(device.servos)
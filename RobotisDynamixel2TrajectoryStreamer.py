@@ -0,0 +1,122 @@
+import time
+import perilib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class RobotisDynamixel2TrajectoryReport():
+
+    def __init__(self, deadlines, send_times, feedback):
+        # absolute deadlines and actual send times (NaN where a tick was
+        # skipped), both in time.monotonic() seconds
+        self.deadlines = deadlines
+        self.send_times = send_times
+        self.jitter = send_times - deadlines
+        self.missed = numpy.flatnonzero(numpy.isnan(send_times))
+
+        # timesteps x servos x fields of feedback read between ticks (NaN
+        # where no read fit in the gap), or None without feedback fields
+        self.feedback = feedback
+
+    def __str__(self):
+        sent = self.jitter[~numpy.isnan(self.jitter)]
+        if len(sent) == 0:
+            return "%d tick(s), none sent" % len(self.deadlines)
+        return "%d tick(s), %d missed, jitter mean %.03f ms, max %.03f ms" % (
+                len(self.deadlines), len(self.missed), sent.mean() * 1000, sent.max() * 1000)
+
+class RobotisDynamixel2TrajectoryStreamer():
+
+    # sleep until this close to a deadline, then spin for the rest
+    spin_time = 0.001
+
+    def __init__(self, device, servo_ids, period, field_name="goal_position", feedback_fields=None, max_lateness=None):
+        if numpy is None:
+            raise perilib.PerilibProtocolException("numpy is required for trajectory streaming")
+        self.device = device
+        self.servo_ids = list(servo_ids)
+        self.period = period
+        self.field_name = field_name
+        self.feedback_fields = list(feedback_fields) if feedback_fields is not None else None
+
+        # ticks later than this are dropped so playback does not fall behind
+        self.max_lateness = max_lateness if max_lateness is not None else period / 2
+
+        # one reusable sync_write packet; each tick only patches values + CRC
+        self.template = device.prepare_sync_write([field_name], self.servo_ids)
+
+        # running estimate of how long a feedback sync_read takes
+        self.feedback_time = None
+
+    def play(self, trajectory, start_time=None, on_feedback=None):
+        # trajectory is timesteps x servos of raw field values; tick k is sent
+        # at start_time + k * period
+        trajectory = numpy.asarray(trajectory)
+        if trajectory.ndim != 2 or trajectory.shape[1] != len(self.servo_ids):
+            raise perilib.PerilibProtocolException(
+                    "Trajectory must be timesteps x %d servos, got shape %s" % (len(self.servo_ids), trajectory.shape))
+        rows = numpy.rint(trajectory).astype(numpy.int64).tolist()
+        if start_time is None:
+            start_time = time.monotonic() + self.period
+        deadlines = start_time + numpy.arange(len(rows)) * self.period
+        send_times = numpy.full(len(rows), numpy.nan)
+        feedback = None
+        if self.feedback_fields is not None:
+            feedback = numpy.full((len(rows), len(self.servo_ids), len(self.feedback_fields)), numpy.nan)
+
+        last_sent = None
+        for tick, row in enumerate(rows):
+            deadline = deadlines[tick]
+            self.wait_until(deadline)
+
+            # drop a tick that is already too late, unless it is the final pose
+            now = time.monotonic()
+            if now - deadline > self.max_lateness and tick < len(rows) - 1:
+                continue
+            with self.device.bus_lock:
+                send_times[tick] = time.monotonic()
+                self.device.send_template(self.template, row)
+            last_sent = row
+
+            # use the gap before the next tick for feedback, if a read fits
+            if feedback is not None:
+                next_deadline = deadline + self.period
+                if self.feedback_fits(next_deadline):
+                    self.read_feedback(tick, feedback, next_deadline, on_feedback)
+
+        # sync_write has no reply, so mirror the final pose locally
+        if last_sent is not None:
+            self.device.store_values(self.field_name, dict(zip(self.servo_ids, last_sent)))
+        return RobotisDynamixel2TrajectoryReport(deadlines, send_times, feedback)
+
+    def wait_until(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining > self.spin_time:
+            time.sleep(remaining - self.spin_time)
+        while time.monotonic() < deadline:
+            pass
+
+    def feedback_fits(self, next_deadline):
+        # with no estimate yet, try a read whenever at least half a period is
+        # left; after that, require the estimate plus a safety margin
+        remaining = next_deadline - time.monotonic()
+        if self.feedback_time is None:
+            return remaining > self.period / 2
+        return remaining > self.feedback_time * 1.5 + self.spin_time
+
+    def read_feedback(self, tick, feedback, next_deadline, on_feedback=None):
+        started = time.monotonic()
+        responses = self.device.sync_read(self.feedback_fields, self.servo_ids,
+                timeout=max(next_deadline - started - self.spin_time, 0))
+        elapsed = time.monotonic() - started
+        self.feedback_time = elapsed if self.feedback_time is None else 0.8 * self.feedback_time + 0.2 * elapsed
+
+        for index, id in enumerate(self.servo_ids):
+            if responses.get(id) is not None:
+                control_table = self.device.servos[id].control_table
+                feedback[tick, index] = [numpy.nan if value is None else value
+                        for value in [control_table[field_name] for field_name in self.feedback_fields]]
+        if on_feedback is not None:
+            on_feedback(tick, responses)
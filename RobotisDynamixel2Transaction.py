@@ -0,0 +1,191 @@
+import collections
+import concurrent.futures
+import threading
+import time
+
+from .RobotisDynamixel2Protocol import *
+
+class RobotisDynamixel2Transaction():
+
+    def __init__(self, packet_name, kwargs, response_name, expected_ids, callback=None, future=None):
+        self.packet_name = packet_name
+        self.kwargs = kwargs
+        self.response_name = response_name
+        
+        # IDs expected to answer (None means whoever answers before timeout)
+        self.expected_ids = expected_ids
+        self.responses = {}
+        self.packet = None
+        self.deadline = None
+        self.timer = None
+        self.future = future if future is not None else concurrent.futures.Future()
+        if callback is not None:
+            self.future.add_done_callback(callback)
+            
+    @classmethod
+    def resolve(cls, _packet_name, kwargs):
+        # prepend instruction slug if no slug present
+        if _packet_name not in RobotisDynamixel2Protocol.definitions_by_name:
+            _packet_name = "inst_" + _packet_name
+        (packet_type, instruction, definition) = RobotisDynamixel2Protocol.definitions_by_name[_packet_name]
+        
+        # work out which servos will answer this instruction
+        response_name = definition.get("response_required")
+        expected_ids = None
+        if response_name is not None:
+            if kwargs["id"] != 0xFE or _packet_name.startswith("inst_fast_"):
+                # unicast, or fast read with one combined reply from ID 0xFE
+                expected_ids = [kwargs["id"]]
+            elif "id_list" in kwargs:
+                expected_ids = list(kwargs["id_list"])
+            elif "id_address_length_list" in kwargs:
+                expected_ids = list(kwargs["id_address_length_list"][0::5])
+            elif _packet_name != "inst_ping":
+                # other broadcast instructions get no status reply
+                response_name = None
+                
+        return (_packet_name, response_name, expected_ids)
+        
+    def accepts(self, packet):
+        return packet.name == self.response_name \
+                and (self.expected_ids is None or packet.id in self.expected_ids) \
+                and packet.id not in self.responses
+                
+    def is_complete(self):
+        return self.expected_ids is not None and len(self.responses) == len(self.expected_ids)
+        
+    def complete(self):
+        if self.future.done():
+            # already resolved elsewhere (e.g. cancelled by an asyncio caller)
+            return
+        if self.response_name is None:
+            # nothing to wait for, report the packet that was sent
+            self.future.set_result(self.packet)
+        elif self.expected_ids is not None and len(self.expected_ids) == 1:
+            # single reply (or None if it timed out), same as send_and_wait
+            self.future.set_result(self.responses.get(self.expected_ids[0]))
+        elif self.expected_ids is not None:
+            # one reply per listed servo, in request order, None if missing
+            self.future.set_result({ id: self.responses.get(id) for id in self.expected_ids })
+        else:
+            self.future.set_result(self.responses)
+            
+class RobotisDynamixel2TransactionQueue():
+
+    # how soon to try again when another thread holds the device's bus lock
+    retry_interval = 0.002
+
+    def __init__(self, device, max_in_flight=1, timeout=None):
+        self.device = device
+        
+        # more than one outstanding reply is only safe if servo return delay
+        # times leave room for the next instruction before the bus turns around
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout if timeout is not None else RobotisDynamixel2Protocol.response_packet_timeout
+        self.queued = collections.deque()
+        self.in_flight = []
+        self.lock = threading.RLock()
+        self.retry_timer = None
+        
+    def submit(self, _packet_name, _callback=None, **kwargs):
+        (_packet_name, response_name, expected_ids) = RobotisDynamixel2Transaction.resolve(_packet_name, kwargs)
+        transaction = RobotisDynamixel2Transaction(_packet_name, kwargs, response_name, expected_ids, _callback)
+        with self.lock:
+            self.queued.append(transaction)
+            self.process()
+        return transaction.future
+        
+    def process(self):
+        finished = []
+        with self.lock:
+            # expire transactions whose replies did not all arrive in time
+            now = time.monotonic()
+            for transaction in list(self.in_flight):
+                if now >= transaction.deadline:
+                    self.in_flight.remove(transaction)
+                    finished.append(transaction)
+                    
+            # put queued instructions on the wire back to back while allowed
+            while len(self.queued) > 0 and self.can_send(self.queued[0]):
+                # never transmit into another thread's transaction (e.g. a
+                # sync_read collecting replies); this also runs on the reader
+                # thread, which must not block on the bus lock, so retry later
+                if not self.device.bus_lock.acquire(blocking=False):
+                    self.schedule_retry()
+                    break
+                try:
+                    transaction = self.queued.popleft()
+                    transaction.packet = self.device.stream.parser_generator.send_packet(transaction.packet_name, **transaction.kwargs)
+                finally:
+                    self.device.bus_lock.release()
+                if transaction.response_name is None:
+                    finished.append(transaction)
+                else:
+                    transaction.deadline = time.monotonic() + self.timeout
+                    self.in_flight.append(transaction)
+                    
+                    # expire on time even if no other traffic calls process()
+                    transaction.timer = threading.Timer(self.timeout, self.expire, [transaction])
+                    transaction.timer.daemon = True
+                    transaction.timer.start()
+                    
+        # report completions outside the lock so callbacks may submit more
+        for transaction in finished:
+            if transaction.timer is not None:
+                transaction.timer.cancel()
+            transaction.complete()
+            
+    def schedule_retry(self):
+        if self.retry_timer is None:
+            self.retry_timer = threading.Timer(self.retry_interval, self.retry)
+            self.retry_timer.daemon = True
+            self.retry_timer.start()
+            
+    def retry(self):
+        with self.lock:
+            self.retry_timer = None
+        self.process()
+        
+    def expire(self, transaction):
+        # deadline timer: report whatever replies arrived, then free the bus
+        with self.lock:
+            if transaction not in self.in_flight:
+                return
+            self.in_flight.remove(transaction)
+        transaction.complete()
+        self.process()
+        
+    def can_send(self, transaction):
+        if len(self.in_flight) == 0:
+            return True
+        if transaction.response_name is None or len(self.in_flight) >= self.max_in_flight:
+            # never transmit over a reply that is still due
+            return False
+            
+        # replies must stay unambiguous: no open-ended broadcasts, and at most
+        # one outstanding transaction per servo
+        if transaction.expected_ids is None:
+            return False
+        for other in self.in_flight:
+            if other.expected_ids is None or set(other.expected_ids) & set(transaction.expected_ids):
+                return False
+        return True
+        
+    def on_rx_packet(self, packet):
+        finished = []
+        with self.lock:
+            # correlate by (servo ID, instruction) rather than arrival order
+            for transaction in self.in_flight:
+                if transaction.accepts(packet):
+                    transaction.responses[packet.id] = packet
+                    if transaction.is_complete():
+                        self.in_flight.remove(transaction)
+                        finished.append(transaction)
+                    break
+                    
+        for transaction in finished:
+            transaction.timer.cancel()
+            transaction.complete()
+            
+        # the bus may be free now, send whatever is next
+        self.process()
@@ -14,3 +14,15 @@ from .RobotisDynamixel2ParserGenerator import *
 from .RobotisDynamixel2Packet import *
 from .RobotisDynamixel2Servo import *
 from .RobotisDynamixel2ControlTable import *
+from .RobotisDynamixel2Crc import *
+from .RobotisDynamixel2Framer import *
+from .RobotisDynamixel2Stuffing import *
+from .RobotisDynamixel2PacketTemplate import *
+from .RobotisDynamixel2Transaction import *
+from .RobotisDynamixel2Async import *
+from .RobotisDynamixel2BusGroup import *
+from .RobotisDynamixel2TopologyCache import *
+from .RobotisDynamixel2IndirectMap import *
+from .RobotisDynamixel2Telemetry import *
+from .RobotisDynamixel2BatchDecoder import *
+from .RobotisDynamixel2TrajectoryStreamer import *
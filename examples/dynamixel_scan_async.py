@@ -0,0 +1,49 @@
+# check for local development repo in script path and use it for imports
+import os, sys
+path_parts = os.path.dirname(os.path.realpath(__file__)).split(os.sep)
+if "perilib-python-core" in path_parts:
+    sys.path.insert(0, os.sep.join(path_parts[:-path_parts[::-1].index("perilib-python-core")]))
+
+import asyncio
+import perilib
+import perilib.robotis_dynamixel2
+
+# requires pyserial-asyncio; change the port to match your USB2Dynamixel/U2D2
+PORT = "/dev/ttyUSB0" if os.name != "nt" else "COM3"
+BAUDRATE = 57600
+
+async def main():
+    # open the serial port as an asyncio transport (no polling loop needed)
+    dxl = await perilib.robotis_dynamixel2.RobotisDynamixel2AsyncDevice.open_serial(PORT, BAUDRATE)
+
+    # query servos on the bus
+    print("Dynamixel servo bus connected, scanning for servos...")
+    await dxl.scan_async()
+
+    # show list of attached servos
+    print("Found %d servo(s)" % len(dxl.servos))
+    [print(" - %s" % servo) for id, servo in dxl.servos.items()]
+
+    # read control tables for each
+    print("Reading control tables for attached servos")
+    for id, servo in dxl.servos.items():
+        await servo.read_control_table_async()
+        print("Servo #%d" % id)
+        print("  - operating_mode: %d" % servo.control_table.operating_mode)
+        print("  - present_position: %d" % servo.control_table.present_position)
+        print("  - present_velocity: %d" % servo.control_table.present_velocity)
+
+    # poll positions of all servos together a few times
+    for i in range(10):
+        await dxl.sync_read_async(["present_position"])
+        print(" ".join(["#%d=%d" % (id, servo.control_table.present_position) for id, servo in dxl.servos.items()]))
+        await asyncio.sleep(0.1)
+
+    dxl.close()
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Ctrl+C detected, terminating script")
+        sys.exit(0)
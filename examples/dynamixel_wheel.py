@@ -92,11 +92,15 @@ def main():
                 print("Found %d servo(s)" % len(app.dxl.servos))
                 [print(" - %s" % servo) for id, servo in app.dxl.servos.items()]
 
-                # set server #1 to wheel mode
-                app.dxl.servos[1].update_value("torque_enable", 0)
-                app.dxl.servos[1].update_value("operating_mode", 1)
-                app.dxl.servos[1].update_value("goal_velocity", 0)
-                app.dxl.servos[1].update_value("torque_enable", 0)
+                # set server #1 to wheel mode (staged locally, then written in
+                # as few packets as possible, skipping values already set)
+                servo = app.dxl.servos[1]
+                servo.read_control_table()
+                servo.control_table.write_back = True
+                servo.control_table.torque_enable = 0
+                servo.control_table.operating_mode = 1
+                servo.control_table.goal_velocity = 0
+                servo.flush()
                 
             elif time.time() - last_tick > 1:
                 last_tick = time.time()
@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+from perilib.robotis_dynamixel2 import RobotisDynamixel2Crc
+
+def reference_crc(crc_accum, data):
+    # bit-by-bit CRC-16 (poly 0x8005, MSB first), independent of the tables
+    for b in data:
+        crc_accum ^= b << 8
+        for bit in range(8):
+            crc_accum = ((crc_accum << 1) ^ 0x8005) if crc_accum & 0x8000 else (crc_accum << 1)
+            crc_accum &= 0xFFFF
+    return crc_accum
+
+@pytest.fixture
+def restore_backend():
+    (name, short_length) = (RobotisDynamixel2Crc.backend_name, RobotisDynamixel2Crc.short_length)
+    yield
+    RobotisDynamixel2Crc.set_backend(name, short_length)
+
+@pytest.mark.parametrize("name", sorted(RobotisDynamixel2Crc.backends))
+def test_backend_known_answers(name):
+    update = RobotisDynamixel2Crc.backends[name]
+    for (frame, crc) in RobotisDynamixel2Crc.known_answers:
+        assert update(0, frame) == crc
+        assert reference_crc(0, frame) == crc
+
+@pytest.mark.parametrize("name", sorted(RobotisDynamixel2Crc.backends))
+def test_backend_matches_reference(name):
+    update = RobotisDynamixel2Crc.backends[name]
+    rng = random.Random(name)
+    for length in range(0, 70):
+        data = bytes(rng.randrange(256) for _ in range(length))
+        crc_accum = rng.randrange(0x10000)
+        assert update(crc_accum, data) == reference_crc(crc_accum, data)
+        assert update(crc_accum, memoryview(data)) == reference_crc(crc_accum, data)
+
+@pytest.mark.parametrize("name", sorted(RobotisDynamixel2Crc.backends))
+def test_backend_passes_verification(name):
+    assert RobotisDynamixel2Crc.verify_backend(RobotisDynamixel2Crc.backends[name])
+
+@pytest.mark.parametrize("name", sorted(RobotisDynamixel2Crc.backends))
+def test_update_dispatch(name, restore_backend):
+    # short frames go through the bytewise loop, longer ones through the backend
+    RobotisDynamixel2Crc.set_backend(name, 16)
+    rng = random.Random(1)
+    for length in (0, 1, 14, 15, 16, 17, 64, 300):
+        data = bytes(rng.randrange(256) for _ in range(length))
+        assert RobotisDynamixel2Crc.update(0, data) == reference_crc(0, data)
+
+def test_incremental_update():
+    data = bytes(range(200))
+    crc = RobotisDynamixel2Crc.update(0, data[:8])
+    crc = RobotisDynamixel2Crc.update(crc, data[8:])
+    assert crc == reference_crc(0, data)
+
+def test_calculate_batch():
+    rng = random.Random(2)
+    frames = [bytes(rng.randrange(256) for _ in range(rng.randrange(0, 40))) for _ in range(50)]
+    assert RobotisDynamixel2Crc.calculate_batch(frames) == [reference_crc(0, frame) for frame in frames]
+
+def test_set_backend_rejects_unknown_name(restore_backend):
+    with pytest.raises(ValueError):
+        RobotisDynamixel2Crc.set_backend("no-such-backend")
+
+def test_select_fastest_backend(restore_backend):
+    timings = RobotisDynamixel2Crc.select_fastest_backend(rounds=10)
+    assert RobotisDynamixel2Crc.backend_name in timings
+    assert RobotisDynamixel2Crc.update(0, bytes(range(100))) == reference_crc(0, bytes(range(100)))
@@ -0,0 +1,45 @@
+import random
+
+from perilib.robotis_dynamixel2 import RobotisDynamixel2Stuffing
+
+PATTERN = b"\xFF\xFF\xFD"
+STUFFED_PATTERN = b"\xFF\xFF\xFD\xFD"
+
+def random_payloads(count, seed=0):
+    # bytes drawn from a tiny alphabet so FF FF FD (and FF FF FD FD) runs,
+    # odd runs of FF and back-to-back patterns all show up often
+    rng = random.Random(seed)
+    for _ in range(count):
+        length = rng.randrange(0, 64)
+        yield bytes(rng.choice(b"\xFF\xFD\x00\x01") for _ in range(length))
+
+def test_stuff_matches_replace():
+    for payload in random_payloads(20000):
+        assert bytes(RobotisDynamixel2Stuffing.stuff(payload)) == payload.replace(PATTERN, STUFFED_PATTERN)
+
+def test_unstuff_matches_replace():
+    for payload in random_payloads(20000, seed=1):
+        stuffed = payload.replace(PATTERN, STUFFED_PATTERN)
+        assert bytes(RobotisDynamixel2Stuffing.unstuff(stuffed)) == stuffed.replace(STUFFED_PATTERN, PATTERN)
+
+def test_round_trip():
+    for payload in random_payloads(20000, seed=2):
+        assert bytes(RobotisDynamixel2Stuffing.unstuff(RobotisDynamixel2Stuffing.stuff(payload))) == payload
+
+def test_payload_without_pattern_is_returned_unchanged():
+    payload = bytes(range(0xFD)) * 4
+    assert RobotisDynamixel2Stuffing.stuff(payload) is payload
+    assert RobotisDynamixel2Stuffing.unstuff(payload) is payload
+
+def test_memoryview_without_pattern_is_not_copied():
+    frame = memoryview(b"\xFF\xFF\xFD\x00\x01\x07\x00\x55\x00\xFF\xFF\x01\x00\x00")[8:-2]
+    assert RobotisDynamixel2Stuffing.unstuff(frame) is frame
+
+def test_memoryview_round_trip():
+    for payload in random_payloads(5000, seed=3):
+        stuffed = b"\x00" + payload.replace(PATTERN, STUFFED_PATTERN) + b"\x00"
+        assert bytes(RobotisDynamixel2Stuffing.unstuff(memoryview(stuffed)[1:-1])) == payload
+
+def test_non_bytes_input():
+    assert bytes(RobotisDynamixel2Stuffing.stuff([0xFF, 0xFF, 0xFD, 0x01])) == b"\xFF\xFF\xFD\xFD\x01"
+    assert bytes(RobotisDynamixel2Stuffing.unstuff(memoryview(b"\xFF\xFF\xFD\xFD\x01"))) == b"\xFF\xFF\xFD\x01"